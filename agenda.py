@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Agenda of rules with pluggable conflict resolution"
+
+import heapq
+from itertools import count
+
+#==================== conflict resolution: key(rule, calcul) ============#
+def by_order(rule, calcul) -> tuple:
+    """ rule order """
+    return (rule.idnum,)
+
+def by_specificity(rule, calcul) -> tuple:
+    """ more premises first """
+    return -len(rule.gauche), rule.idnum
+
+def by_fiabilite(rule, calcul) -> tuple:
+    """ most reliable first """
+    return -rule.fiabilite, rule.idnum
+
+def by_recency(rule, calcul) -> tuple:
+    """ rules using the most recent facts first """
+    return -calcul.get_recency(rule.gauche), rule.idnum
+
+def by_mycin(rule, calcul) -> tuple:
+    """ Mycin.resolve_conflicts(1): fiabilite, then fewer premises,
+        then the best evaluation of the premises
+    """
+    return (-rule.fiabilite, len(rule.gauche),
+            -calcul.get_evalLeft(rule.gauche), rule.idnum)
+
+def by_learned(rule, calcul) -> tuple:
+    """ best expected success per unit cost (calcul.stats) first,
+        rule order without statistics
+    """
+    if calcul.stats is None: return (rule.idnum,)
+    return -calcul.stats.score(calcul.rule_text(rule)), rule.idnum
+
+STRATEGIES = {'order': by_order, 'specificity': by_specificity,
+              'fiabilite': by_fiabilite, 'recency': by_recency,
+              'mycin': by_mycin, 'learned': by_learned}
+
+class Agenda:
+    """ rules waiting to be triggered, backed by a heap
+        - the last batch pushed is served first (depth first)
+        - inside a batch, the strategy decides
+    """
+    __slots__ = ('__heap', '__batch', '__seq', '__key', '__calcul')
+    def __init__(self, calcul, strategy='order') -> None:
+        """ strategy: a name in STRATEGIES or a callable key(rule, calcul) """
+        if not callable(strategy):
+            if strategy not in STRATEGIES:
+                raise ValueError("unknown strategy {}".format(strategy))
+            strategy = STRATEGIES[strategy]
+        self.__key = strategy
+        self.__calcul = calcul
+        self.__heap = []
+        self.__batch = 0
+        self.__seq = count()
+
+    def __len__(self) -> int: return len(self.__heap)
+    def __iter__(self):
+        """ rules in heap order, not the order they will be popped """
+        return (x[-1] for x in self.__heap)
+
+    def peek(self, n:int=1) -> list:
+        """ the next n rules in the order they will be popped, O(len) """
+        return [x[-1] for x in heapq.nsmallest(n, self.__heap)]
+
+    def in_order(self) -> list:
+        """ every rule in the order they will be popped, O(len log len) """
+        return [x[-1] for x in sorted(self.__heap)]
+
+    def push_all(self, rules:list) -> None:
+        """ a new batch, served before the older ones """
+        self.__batch += 1
+        for r in rules:
+            heapq.heappush(self.__heap,
+                           (-self.__batch, self.__key(r, self.__calcul),
+                            next(self.__seq), r))
+
+    def pop(self):
+        """ next rule, O(log n) """
+        return heapq.heappop(self.__heap)[-1]
+
+    def clear(self) -> None:
+        self.__heap.clear()
+
+    def dump(self) -> tuple:
+        """ plain data, rules by idnum, for a checkpoint """
+        return self.__batch, [(b, k, n, r.idnum) for b, k, n, r
+                              in self.__heap]
+
+    def load(self, data:tuple, rules:dict) -> None:
+        """ back to a dump, rules: idnum -> Regle """
+        self.__batch, _heap = data
+        self.__heap = [(b, tuple(k), n, rules[i]) for b, k, n, i in _heap]
+        heapq.heapify(self.__heap)
+        self.__seq = count(1 + max([n for _, _, n, _ in _heap], default=-1))
+
+def ordered(calcul, rules:list, strategy='order') -> list:
+    """ rules sorted by a strategy, used for a bfs layer """
+    if strategy == 'order': return list(rules)
+    _ag = Agenda(calcul, strategy)
+    _ag.push_all(rules)
+    return _ag.in_order()
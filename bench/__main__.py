@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+from bench.runner import main
+
+sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Synthetic knowledge bases for the benchmarks"
+
+import random
+from collections import namedtuple
+
+# rules: list of str "a & b -> c [fiab]"
+# facts: dict userid -> belief, goals: list of userid
+# opposition: True if build_opposition is required
+KB = namedtuple('KB', 'name size rules facts goals opposition')
+
+def chain(n:int) -> KB:
+    """ a0 -> a1 -> ... -> an """
+    _rules = ["a{} -> a{}".format(i, i+1) for i in range(n)]
+    return KB('chain', n, _rules, {'a0': 1}, ['a{}'.format(n)], False)
+
+def fan_in(n:int) -> KB:
+    """ n single premise rules and one n-premises rule towards y """
+    _x = ["x{}".format(i) for i in range(n)]
+    _rules = ["{} -> y".format(x) for x in _x]
+    _rules.append("{} -> z".format(" & ".join(_x)))
+    _rules.append("y & z -> goal")
+    return KB('fan_in', n, _rules, {x: 1 for x in _x}, ['goal'], False)
+
+def layered(n:int, width:int=10, arity:int=2, seed:int=42) -> KB:
+    """ n layers of width atoms, each atom depends on arity atoms
+        of the previous layer
+    """
+    _rnd = random.Random(seed)
+    _rules = []
+    for l in range(1, n+1):
+        for i in range(width):
+            _prem = _rnd.sample(range(width), min(arity, width))
+            _rules.append("{} -> l{}n{}".format(
+                " & ".join(["l{}n{}".format(l-1, j) for j in _prem]), l, i))
+    _facts = {"l0n{}".format(i): 1 for i in range(width)}
+    return KB('layered', n, _rules, _facts, ["l{}n0".format(n)], False)
+
+def cyclic(n:int, chords:int=None, seed:int=42) -> KB:
+    """ a ring c0 -> c1 -> .. -> c0 with some random chords """
+    _rnd = random.Random(seed)
+    _rules = ["c{} -> c{}".format(i, (i+1) % n) for i in range(n)]
+    for _ in range(n//4 if chords is None else chords):
+        _a, _b = _rnd.randrange(n), _rnd.randrange(n)
+        _rules.append("c{} & c{} -> c{}".format(_a, _b, (_a+_b) % n))
+    _rules.append("c{} -> out".format(n-1))
+    return KB('cyclic', n, _rules, {'c0': 1}, ['out'], False)
+
+def negation(n:int) -> KB:
+    """ p_i & non-q_i -> r_i, r_i -> p_{i+1}, half of the q_i are false """
+    _rules = []
+    for i in range(n):
+        _rules.append("p{0} & non-q{0} -> r{0}".format(i))
+        _rules.append("r{} -> p{}".format(i, i+1))
+        _rules.append("q{0} -> non-r{0}".format(i))
+    _facts = {'p0': 1}
+    _facts.update({"q{}".format(i): -1 for i in range(n)})
+    return KB('negation', n, _rules, _facts, ["p{}".format(n)], True)
+
+def mycin(n:int, width:int=4, seed:int=42) -> KB:
+    """ uncertain layered base, every rule has a fiability """
+    _rnd = random.Random(seed)
+    _rules = []
+    for l in range(1, n+1):
+        for i in range(width):
+            _prem = _rnd.sample(range(width), 2)
+            _rules.append("{} -> m{}n{} {:.2f}".format(
+                " & ".join(["m{}n{}".format(l-1, j) for j in _prem]),
+                l, i, _rnd.uniform(.3, 1.)))
+    _facts = {"m0n{}".format(i): round(_rnd.uniform(.3, 1.), 2)
+              for i in range(width)}
+    return KB('mycin', n, _rules, _facts, ["m{}n0".format(n)], False)
+
+GENERATORS = {f.__name__: f
+              for f in (chain, fan_in, layered, cyclic, negation, mycin)}
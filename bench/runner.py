@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Timed runs of Calcul, json storage and comparison"
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from contextlib import redirect_stdout
+
+from kernel_jalon04 import Calcul
+from skeleton_macaire_suteau import Mycin
+from stats import RuleStats
+from bench.generators import GENERATORS
+
+# default parameters, keep the whole suite within a few minutes
+SIZES = {'chain': (10, 50, 100), 'fan_in': (10, 50, 200),
+         'layered': (3, 6, 10), 'cyclic': (10, 30, 60),
+         'negation': (5, 10, 20), 'mycin': (3, 10, 30)}
+SELECTABLES = "Rules Proofs Queries Contra Negation".split()
+
+def load(c:Calcul, kb) -> Calcul:
+    """ fill c with kb, ensure Fait.ID = Regle.ID = 0 """
+    c.clear()
+    for line in kb.rules: c.add_regle(line)
+    if kb.opposition: c.build_opposition()
+    for k, v in kb.facts.items():
+        c.add_knowledge(k)
+        c.change_knowledge(k, v)
+    return c
+
+def timed(kb, klass, job, goals:bool=True, repeat:int=3) -> dict:
+    """ best and mean time of job(c) on a fresh load of kb """
+    _times = []
+    _out = None
+    with open(os.devnull, 'w') as _null, redirect_stdout(_null):
+        for _ in range(repeat):
+            c = load(klass(), kb)
+            if goals:
+                for g in kb.goals: c.add_goal(g)
+            _t = time.perf_counter()
+            try:
+                _out = job(c)
+            except Exception as _e:
+                return {'error': "{}: {}".format(_e.__class__.__name__, _e)}
+            _times.append(time.perf_counter() - _t)
+    _res = {'best': min(_times), 'mean': sum(_times)/len(_times)}
+    if isinstance(_out, tuple):
+        _res['nbRules'], _res['success'] = _out[0], bool(_out[1])
+    return _res
+
+def _horn(c:Calcul, on:bool) -> Calcul:
+    c.horn_fastpath = on
+    return c
+
+def _learn(c:Calcul, stats) -> Calcul:
+    c.stats = stats
+    return c
+
+def bench_kb(kb, repeat:int=3) -> list:
+    """ every regime, strategy and selectable helper on kb """
+    _rows = []
+    def _row(target, variant, res):
+        res.update(bench=kb.name, size=kb.size,
+                   target=target, variant=variant)
+        _rows.append(res)
+
+    for reg in range(3):
+        for mem in (True, False):
+            for goals in (False, True) if reg < 2 else (True,):
+                _row('resolution', "{}/{}/{}".format(
+                    reg, 'mem' if mem else 'nomem',
+                    'goal' if goals else 'sat'),
+                     timed(kb, Calcul,
+                           lambda c: c.resolution(reg, mem), goals, repeat))
+    for reg in (0, 1):
+        for horn in (True, False):
+            _row('horn', "{}/{}".format(reg, 'on' if horn else 'off'),
+                 timed(kb, Calcul,
+                       lambda c: _horn(c, horn).resolution(reg, True),
+                       False, repeat))
+    _stats = RuleStats() # shared by the repeats: trained by the first one
+    for learned in (False, True):
+        _row('learned', "2/{}".format('on' if learned else 'off'),
+             timed(kb, Calcul,
+                   lambda c: _learn(c, _stats if learned else None
+                                    ).resolution(2, True),
+                   True, repeat))
+    for idx in range(3):
+        _row('mycin', str(idx),
+             timed(kb, Mycin, lambda c: c.resolution(idx, True),
+                   False, repeat))
+    for k in SELECTABLES:
+        _row('selectable', k,
+             timed(kb, Calcul,
+                   lambda c: getattr(c, "selectable{}".format(k))(),
+                   True, repeat))
+    return _rows
+
+def run(names:list=None, sizes:dict=None, repeat:int=3) -> dict:
+    """ the whole suite, json ready """
+    _sizes = SIZES if sizes is None else sizes
+    _rows = []
+    for name in (names or list(GENERATORS)):
+        for n in _sizes[name]:
+            _rows.extend(bench_kb(GENERATORS[name](n), repeat))
+    return {'meta': {'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+                     'python': platform.python_version(),
+                     'machine': platform.machine(),
+                     'repeat': repeat},
+            'results': _rows}
+
+def save(results:dict, path:str) -> None:
+    with open(path, 'w') as f: json.dump(results, f, indent=1)
+
+def load_results(path:str) -> dict:
+    with open(path) as f: return json.load(f)
+
+def _key(row:dict) -> tuple:
+    return row['bench'], row['size'], row['target'], row['variant']
+
+def compare(old:dict, new:dict, threshold:float=1.25) -> list:
+    """ rows whose best time grew by more than threshold
+        :return: list of (key, old best, new best, ratio)
+    """
+    _old = {_key(r): r for r in old['results'] if 'best' in r}
+    _slower = []
+    for r in new['results']:
+        _o = _old.get(_key(r), None)
+        if _o is None or 'best' not in r: continue
+        _ratio = r['best'] / max(_o['best'], 1e-9)
+        if _ratio > threshold:
+            _slower.append((_key(r), _o['best'], r['best'], _ratio))
+    return _slower
+
+def report(results:dict) -> str:
+    _str = ""
+    for r in results['results']:
+        _val = ("{:.6f}s".format(r['best']) if 'best' in r
+                else r.get('error'))
+        if 'nbRules' in r: _val += "  nbRules {}".format(r['nbRules'])
+        _str += "{:<10} {:>5} {:<11} {:<16} {}\n".format(
+            r['bench'], r['size'], r['target'], r['variant'], _val)
+    return _str
+
+def main(argv:list=None) -> int:
+    _p = argparse.ArgumentParser(description=__usage__)
+    _p.add_argument('--bench', nargs='*', choices=list(GENERATORS),
+                    help="generators to run, default all")
+    _p.add_argument('--sizes', nargs='*', type=int,
+                    help="sizes used for every generator, default SIZES")
+    _p.add_argument('--repeat', type=int, default=3)
+    _p.add_argument('--out', help="json file for the results")
+    _p.add_argument('--compare', help="previous json results")
+    _p.add_argument('--threshold', type=float, default=1.25,
+                    help="slowdown ratio reported as regression")
+    _args = _p.parse_args(argv)
+    _sizes = (None if not _args.sizes
+              else {k: _args.sizes for k in GENERATORS})
+    _res = run(_args.bench, _sizes, _args.repeat)
+    print(report(_res), end='')
+    if _args.out: save(_res, _args.out)
+    if _args.compare:
+        _slower = compare(load_results(_args.compare), _res, _args.threshold)
+        for k, a, b, ratio in _slower:
+            print("<!> regression {}: {:.6f}s -> {:.6f}s (x{:.2f})"
+                  "".format(k, a, b, ratio))
+        return 1 if _slower else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Bitset representation of the working memory"
+
+try:
+    import numpy as np
+except ImportError: # optional, python ints are used instead
+    np = None
+
+class TrackedSet(set):
+    """ a set of userid mirrored into a BitMemory """
+    __slots__ = ('_mem', '_attr')
+    def __init__(self, items, mem:'BitMemory', attr:str) -> None:
+        super().__init__(items)
+        self._mem = mem
+        self._attr = attr
+        for k in items: mem.set_bit(attr, k)
+
+    def add(self, key) -> None:
+        set.add(self, key)
+        self._mem.set_bit(self._attr, key)
+    def discard(self, key) -> None:
+        set.discard(self, key)
+        self._mem.clear_bit(self._attr, key)
+    def remove(self, key) -> None:
+        set.remove(self, key)
+        self._mem.clear_bit(self._attr, key)
+    def clear(self) -> None:
+        set.clear(self)
+        self._mem.bits[self._attr] = 0
+    def update(self, keys) -> None:
+        keys = list(keys)
+        set.update(self, keys)
+        for k in keys: self._mem.set_bit(self._attr, k)
+    def difference_update(self, keys) -> None:
+        keys = list(keys)
+        set.difference_update(self, keys)
+        for k in keys: self._mem.clear_bit(self._attr, k)
+
+class BitMemory:
+    """ base, goals and rules as bitsets over the fact slots
+        - python big ints for base and goals
+        - masks of the left/right parts, as ints or packed numpy rows
+    """
+    def __init__(self, numpy:bool=None) -> None:
+        if numpy and np is None:
+            raise ImportError("numpy is required for packed bitsets")
+        self.numpy = np is not None if numpy is None else bool(numpy)
+        self.bits = {'base': 0, 'goals': 0}
+        self.version = None
+        self.__index = {}
+        self.__keys = []
+        self.__rules = []
+        self.__masks = {'left': [], 'right': []}
+        self.__packed = {}
+        self.__width = 0
+
+    def index(self, key:str) -> int:
+        """ slot of key, a new one if key is unknown """
+        _i = self.__index.get(key, None)
+        if _i is None:
+            _i = self.__index[key] = len(self.__keys)
+            self.__keys.append(key)
+        return _i
+
+    def set_bit(self, attr:str, key:str) -> None:
+        if key is None: return
+        self.bits[attr] |= 1 << self.index(key)
+
+    def clear_bit(self, attr:str, key:str) -> None:
+        _i = self.__index.get(key, None)
+        if _i is not None: self.bits[attr] &= ~(1 << _i)
+
+    def keys_of(self, bits:int) -> list:
+        """ userids whose bit is set """
+        _keys = []
+        while bits:
+            _low = bits & -bits
+            _keys.append(self.__keys[_low.bit_length()-1])
+            bits ^= _low
+        return _keys
+
+    def load(self, rules:list, userid, version) -> None:
+        """ masks of every rule, userid: idnum -> key """
+        self.__rules = list(rules)
+        for part in ('left', 'right'):
+            self.__masks[part] = []
+            for r in self.__rules:
+                _m = 0
+                for x in (r.gauche if part == 'left' else r.droite):
+                    _m |= 1 << self.index(userid(x))
+                self.__masks[part].append(_m)
+        self.__width = len(self.__keys)
+        if self.numpy: self.__pack()
+        self.version = version
+
+    def __nbytes(self) -> int:
+        return (self.__width + 7) // 8
+
+    def __pack(self) -> None:
+        """ one row of packed bits per rule, little endian like int """
+        _nb = self.__nbytes()
+        for part, masks in self.__masks.items():
+            _buf = b''.join([m.to_bytes(_nb, 'little') for m in masks])
+            self.__packed[part] = (np.frombuffer(_buf, dtype=np.uint8)
+                                   .reshape(len(masks), _nb))
+
+    def applicable(self, part:str, attr:str) -> list:
+        """ rules whose part ('left'|'right') is included in attr """
+        _known = self.bits[attr]
+        if self.numpy and self.__rules != []:
+            _nb = self.__nbytes()
+            _known &= (1 << (8*_nb)) - 1 # slots created after load
+            _vec = np.frombuffer(_known.to_bytes(_nb, 'little'),
+                                 dtype=np.uint8)
+            _m = self.__packed[part]
+            _ok = np.all((_m & _vec) == _m, axis=1)
+            return [self.__rules[i] for i in np.flatnonzero(_ok)]
+        return [r for r, m in zip(self.__rules, self.__masks[part])
+                if m & _known == m]
+
+    def snapshot(self) -> tuple:
+        """ base and goals as two ints """
+        return self.bits['base'], self.bits['goals']
@@ -1,7 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from collections import deque, OrderedDict
+from collections.abc import Sequence
+import copy
+import hashlib
+import io
+from itertools import islice
+import json
+import marshal
 from numbers import Number
+import os
+import pickle
+import sys
+import time
+import zlib
+
+from array import array
+
+from agenda import Agenda, ordered
+
+TRACE_TOP = 10 # rules of the agenda shown by the fw_dfs trace
 
 def parseRule(regle:str) -> tuple:
     """ regle := gauche -> droite
@@ -42,6 +61,15 @@ class Diagnostic:
     def clear(self):
         self.__storage = ""
         self.__last.clear()
+
+    def dump(self) -> tuple:
+        """ plain data, for a checkpoint """
+        return self.__storage, list(self.__last)
+
+    def load(self, data:tuple) -> None:
+        """ back to a dump """
+        self.__storage, _last = data
+        self.__last = list(_last)
         
 class Fait:
     """ Atomic part of knowledge """
@@ -95,14 +123,20 @@ class Fait:
 class Regle:
     """ <conditions> -> <conclusions> """
     ID = 0
-    def __init__(self, gauche:list, droite:list, fiab:float=1.) -> None:
+    def __init__(self, gauche:list, droite:list, fiab:float=1.,
+                 idnum:int=None) -> None:
         """
         require gauche list of Fait.id
         require droite list of Fait.id
         require fiab in [0, 1]
+        idnum: forced identifier (persistent store), None for a new one
         """
-        self.__id = self.ID
-        Regle.ID += 1
+        if idnum is None:
+            self.__id = self.ID
+            Regle.ID += 1
+        else:
+            self.__id = idnum
+            Regle.ID = max(Regle.ID, idnum+1)
         self.__left = frozenset(gauche)
         self.__right = frozenset(droite)
         self.__fiabilite = fiab
@@ -145,6 +179,398 @@ class Regle:
         """
         pass
 
+class Vue(Sequence):
+    """ read-only lazy view on an internal container
+        items are formatted on demand, len() is O(1) when unfiltered
+    """
+    __slots__ = ('_store', '_raw', '_fmt', '_keep')
+    def __init__(self, store, raw=None, fmt=repr, keep=None) -> None:
+        """ store: sized iterable, raw: element -> raw item
+            fmt: raw item -> displayed item, keep: filter on raw items
+        """
+        self._store = store
+        self._raw = raw
+        self._fmt = fmt
+        self._keep = keep
+
+    def _spawn(self, keep) -> 'Vue':
+        return self.__class__(self._store, self._raw, self._fmt, keep)
+
+    def raw_items(self):
+        """ iterator over the raw (unformatted) items """
+        _it = (self._store if self._raw is None
+               else map(self._raw, self._store))
+        return _it if self._keep is None else filter(self._keep, _it)
+
+    def __iter__(self): return map(self._fmt, self.raw_items())
+    def __len__(self) -> int:
+        if self._keep is None: return len(self._store)
+        return sum([1 for _ in self.raw_items()])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            if any([x is not None and x < 0
+                    for x in (idx.start, idx.stop, idx.step)]):
+                return list(self)[idx]
+            return list(islice(self, idx.start, idx.stop, idx.step))
+        if idx < 0: idx += len(self)
+        for x in islice(self, idx, None): return x
+        raise IndexError("view index out of range")
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Vue, list)): return list(self) == list(other)
+        return NotImplemented
+    def __repr__(self) -> str: return repr(list(self))
+
+    def filter(self, pred) -> 'Vue':
+        """ view restricted to raw items satisfying pred """
+        if self._keep is None: return self._spawn(pred)
+        _old = self._keep
+        return self._spawn(lambda x: _old(x) and pred(x))
+
+class FaitVue(Vue):
+    """ view on (userid, Fait) pairs
+        a userid is looked up in O(1): in facts (userid -> Fait) if given,
+        else in store, then a set of userids turned into pairs by raw
+    """
+    __slots__ = ('_facts',)
+    def __init__(self, store, raw=None, fmt=repr, keep=None,
+                 facts:dict=None) -> None:
+        super().__init__(store, raw, fmt, keep)
+        self._facts = facts
+
+    def _spawn(self, keep) -> 'FaitVue':
+        return self.__class__(self._store, self._raw, self._fmt, keep,
+                              self._facts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, str): # userid
+            if self._facts is not None: _x = (idx, self._facts[idx])
+            elif idx in self._store: _x = self._raw(idx)
+            else: raise KeyError(idx)
+            if self._keep is None or self._keep(_x): return self._fmt(_x)
+            raise KeyError(idx)
+        return super().__getitem__(idx)
+
+    def items(self):
+        """ iterator over the (userid, Fait) pairs """
+        return self.raw_items()
+    def keys(self):
+        return (k for k, _ in self.raw_items())
+
+    def nonzero(self) -> 'FaitVue':
+        """ only facts with a belief different from 0 """
+        return self.filter(lambda x: x[1].valeur != 0)
+
+class Preuve:
+    """ shared proof graph built during inference
+        - fact nodes: given (known at start) or derived
+        - a rule firing links its premises to its conclusion
+    """
+    __slots__ = ('__given', '__firings')
+    def __init__(self) -> None:
+        self.__given = set()
+        self.__firings = {} # atom -> {rule idnum: premises}
+
+    def clear(self, given=()) -> None:
+        """ forget everything, given are the facts known at start """
+        self.__given = set(given)
+        self.__firings.clear()
+
+    def dump(self) -> tuple:
+        """ plain data, for a checkpoint """
+        return (sorted(self.__given),
+                {k: dict(v) for k, v in self.__firings.items()})
+
+    def load(self, data:tuple) -> None:
+        """ back to a dump """
+        _given, _firings = data
+        self.__given = set(_given)
+        self.__firings = {k: {rid: tuple(p) for rid, p in v.items()}
+                          for k, v in _firings.items()}
+
+    def __contains__(self, atom:str) -> bool:
+        return atom in self.__given or atom in self.__firings
+    def __len__(self) -> int:
+        return sum([len(x) for x in self.__firings.values()])
+
+    def add(self, idnum:int, atom:str, premises:list) -> None:
+        """ rule idnum established atom from premises """
+        self.__firings.setdefault(atom, {}).setdefault(
+            idnum, tuple(sorted(premises)))
+
+    def is_given(self, atom:str) -> bool:
+        return atom in self.__given
+    def derived(self) -> list:
+        """ atoms established by at least one rule """
+        return list(self.__firings)
+
+    def why(self, atom:str) -> list:
+        """ the firings concluding atom: list of (rule idnum, premises) """
+        return sorted(self.__firings.get(atom, {}).items())
+
+    def how_many_derivations(self, atom:str) -> int:
+        """ number of distinct proof trees for atom
+            a given fact counts for one, cycles are not proofs
+        """
+        _memo = {}
+        _onstack = set()
+        # frame: atom, firings, firing index, premise index,
+        #        sum, current product, tainted by a cycle
+        _stack = [[atom, self.why(atom), 0, 0,
+                   int(atom in self.__given), 1, False]]
+        _onstack.add(atom)
+        _ret = None
+        while _stack != []:
+            _fr = _stack[-1]
+            if _ret is not None: # a premise has just been counted
+                _val, _tainted = _ret ; _ret = None
+                _fr[5] *= _val ; _fr[6] = _fr[6] or _tainted
+                _fr[3] += 1
+            if _fr[2] >= len(_fr[1]): # all firings done
+                _stack.pop()
+                _onstack.discard(_fr[0])
+                if not _fr[6]: _memo[_fr[0]] = _fr[4]
+                _ret = (_fr[4], _fr[6])
+                continue
+            _prem = _fr[1][_fr[2]][1]
+            if _fr[3] >= len(_prem) or _fr[5] == 0: # firing done
+                _fr[4] += _fr[5] if _fr[3] >= len(_prem) else 0
+                _fr[2] += 1 ; _fr[3] = 0 ; _fr[5] = 1
+                continue
+            _p = _prem[_fr[3]]
+            if _p in _memo: _ret = (_memo[_p], False)
+            elif _p in _onstack: _ret = (0, True)
+            else:
+                _onstack.add(_p)
+                _stack.append([_p, self.why(_p), 0, 0,
+                               int(_p in self.__given), 1, False])
+        return _ret[0]
+
+    def to_dict(self) -> dict:
+        _atoms = set(self.__given).union(self.__firings)
+        for x in self.__firings.values():
+            for _prem in x.values(): _atoms.update(_prem)
+        return {'facts': [{'atom': a, 'given': a in self.__given}
+                          for a in sorted(_atoms)],
+                'firings': [{'rule': r, 'conclusion': a,
+                             'premises': list(p)}
+                            for a in sorted(self.__firings)
+                            for r, p in self.why(a)]}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_dot(self, name:str='preuve') -> str:
+        """ graphviz: atoms are ellipses, firings are boxes """
+        _d = self.to_dict()
+        _s = "digraph {} {{\n".format(name)
+        for f in _d['facts']:
+            _s += '  "{}" [shape=ellipse{}];\n'.format(
+                f['atom'], ', style=filled' if f['given'] else '')
+        for f in _d['firings']:
+            _r = "R{:02d}".format(f['rule'])
+            _s += '  "{}" [shape=box];\n'.format(_r)
+            for p in f['premises']:
+                _s += '  "{}" -> "{}";\n'.format(p, _r)
+            _s += '  "{}" -> "{}";\n'.format(_r, f['conclusion'])
+        return _s + "}\n"
+
+class BudgetExceeded(Exception):
+    """ raised inside the chainers, the message is the reason """
+
+class Budget:
+    """ limits for one resolution, None means unbounded
+        - deadline: seconds allowed
+        - max_firings: rules triggered
+        - max_agenda: rules waiting in the agenda
+        - max_memo: entries in the memory of the chainer
+    """
+    __slots__ = ('deadline', 'max_firings', 'max_agenda', 'max_memo',
+                 '__end', '__calls')
+    CLOCK_EVERY = 32 # the clock is read once every CLOCK_EVERY checks
+
+    def __init__(self, deadline:float=None, max_firings:int=None,
+                 max_agenda:int=None, max_memo:int=None) -> None:
+        self.deadline = deadline
+        self.max_firings = max_firings
+        self.max_agenda = max_agenda
+        self.max_memo = max_memo
+        self.__end = None
+        self.__calls = 0
+
+    def start(self) -> None:
+        """ the deadline starts now """
+        self.__calls = 0
+        self.__end = (None if self.deadline is None
+                      else time.monotonic() + self.deadline)
+
+    def exceeded(self, firings:int, agenda:int=0, memo:int=0) -> str:
+        """ reason for stopping, None while within budget """
+        if self.max_firings is not None and firings >= self.max_firings:
+            return "max_firings"
+        if self.max_agenda is not None and agenda > self.max_agenda:
+            return "max_agenda"
+        if self.max_memo is not None and memo > self.max_memo:
+            return "max_memo"
+        if self.__end is not None:
+            self.__calls += 1
+            if (self.__calls % self.CLOCK_EVERY == 0 and
+                time.monotonic() > self.__end):
+                return "deadline"
+        return None
+
+class _PlainUnpickler(pickle.Unpickler):
+    """ builtin containers and scalars only: no class is ever looked up,
+        so loading a checkpoint cannot run code
+    """
+    def find_class(self, module:str, name:str):
+        raise pickle.UnpicklingError("checkpoint: {}.{} refused"
+                                     "".format(module, name))
+
+class Checkpoint:
+    """ where and how often resolution saves its state
+        - every: rules triggered between two saves
+        - seconds: or wall time between two saves
+        the file is a zlib compressed pickle of plain data (dict, list,
+        tuple, set, str, numbers), written atomically; load refuses
+        anything else
+    """
+    MAGIC = "calcul-checkpoint/2"
+
+    def __init__(self, path:str, every:int=1000,
+                 seconds:float=None) -> None:
+        self.path = path
+        self.every = every
+        self.seconds = seconds
+        self.saved = 0
+        self.__last = (0, time.monotonic())
+
+    def due(self, nbRules:int) -> bool:
+        _n, _t = self.__last
+        if self.every is not None and nbRules - _n >= self.every:
+            return True
+        return (self.seconds is not None and
+                time.monotonic() - _t >= self.seconds)
+
+    def save(self, state:dict, nbRules:int=0) -> None:
+        _data = zlib.compress(pickle.dumps((self.MAGIC, state), 4))
+        with open(self.path + '.tmp', 'wb') as f: f.write(_data)
+        os.replace(self.path + '.tmp', self.path)
+        self.saved += 1
+        self.__last = (nbRules, time.monotonic())
+
+    @classmethod
+    def load(cls, src) -> dict:
+        """ src: a path or the bytes of a checkpoint """
+        if isinstance(src, str):
+            with open(src, 'rb') as f: src = f.read()
+        _magic, _state = _PlainUnpickler(
+            io.BytesIO(zlib.decompress(src))).load()
+        if _magic != cls.MAGIC:
+            raise ValueError("not a checkpoint: {}".format(_magic))
+        return _state
+
+class ResultCache:
+    """ LRU of resolution outcomes, emptied when the kb version moves
+        an entry: (nbRules, success), new facts, trace, state
+    """
+    def __init__(self, size:int=128) -> None:
+        self.size = size
+        self.version = None
+        self.hits = self.misses = 0
+        self.__lru = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__lru)
+
+    def clear(self) -> None:
+        self.__lru.clear()
+
+    def __check(self, version:int) -> None:
+        if version != self.version:
+            self.__lru.clear()
+            self.version = version
+
+    def get(self, key:str, version:int) -> tuple:
+        self.__check(version)
+        _entry = self.__lru.get(key, None)
+        if _entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__lru.move_to_end(key)
+        return _entry
+
+    def put(self, key:str, version:int, entry:tuple) -> None:
+        self.__check(version)
+        self.__lru[key] = entry
+        self.__lru.move_to_end(key)
+        while len(self.__lru) > self.size: self.__lru.popitem(last=False)
+
+class Metrics:
+    """ opt-in counters for the hot paths of Calcul """
+    __slots__ = ('calls', 'times', 'scanned', 'fired', 'memo_hits',
+                 'agenda')
+    def __init__(self, maxlen:int=10000) -> None:
+        self.calls = {}
+        self.times = {}
+        self.scanned = 0 # rules looked at by selectableRules
+        self.fired = 0 # rules whose conclusion was established
+        self.memo_hits = 0 # backward chaining memory
+        self.agenda = deque(maxlen=maxlen) # agenda length over time
+
+    def clear(self) -> None:
+        self.calls.clear()
+        self.times.clear()
+        self.scanned = self.fired = self.memo_hits = 0
+        self.agenda.clear()
+
+    def wrap(self, name:str, meth):
+        """ count calls and wall time of a bound method """
+        def _timed(*args, **kwargs):
+            _t = time.perf_counter()
+            try:
+                return meth(*args, **kwargs)
+            finally:
+                self.times[name] = (self.times.get(name, 0.)
+                                    + time.perf_counter() - _t)
+                self.calls[name] = self.calls.get(name, 0) + 1
+        return _timed
+
+    def snapshot(self) -> dict:
+        """ plain dict, ready to be scraped """
+        return {'calls': dict(self.calls), 'times': dict(self.times),
+                'scanned': self.scanned, 'fired': self.fired,
+                'memo_hits': self.memo_hits, 'agenda': list(self.agenda)}
+
+class Opposition:
+    """ complementary literals, each literal has at most one opposite """
+    __slots__ = ('__partner',)
+    def __init__(self) -> None:
+        self.__partner = {}
+
+    def clear(self) -> None:
+        """ forget every pair """
+        self.__partner.clear()
+
+    def __contains__(self, key:str) -> bool: return key in self.__partner
+    def __len__(self) -> int: return len(self.__partner) // 2
+
+    def get(self, key:str, default=None) -> str:
+        """ the opposite of key if there is one """
+        return self.__partner.get(key, default)
+
+    def pairs(self, keys) -> list:
+        """ (key, opposite) for the keys having one """
+        _p = self.__partner
+        return [(k, _p[k]) for k in keys if k in _p]
+
+    def bind(self, k1:str, k2:str) -> None:
+        """ record k1 <-> k2 """
+        self.__partner[k1] = k2
+        self.__partner[k2] = k1
+
 class Calcul:
     """ the core of the system 
         - a table linking external name and internal name
@@ -155,24 +581,68 @@ class Calcul:
     def __init__(self) -> None:
         self.__symbTab = {}
         self.__reverseSym = {}
-        self.__negation = {}
-        self.__rules = []
+        self.__negation = Opposition()
+        self.__positives = set()
+        self.__negatives = set()
+        self.__fresh = [] # symbols not yet seen by build_opposition
+        self.__rules = {} # idnum -> Regle, in order of creation
         self.__base = set()
         self.__query = set()
         self.__diag = Diagnostic()
         self.__neg = "not- non- pas-".split()
         self.__inconsistance = False
+        self.early_conflict = False # stop as soon as a conflict is derivable
+        self.__trace = {} # atom -> rule which established it
+        self.__conflict = None
+        self.__metrics = None
+        self.__proof = Preuve()
+        self.__version = 0 # changes with the knowledge base
+        self.parallel = 0 # number of workers for fw_bfs, 0: sequential
+        self.strategy = 'order' # conflict resolution, see agenda.py
+        self.__stamp = {} # userid -> time of the last change
+        self.__tick = 0
+        self.__layer = None
+        self.__compiled = None # frozenset of idnum -> evaluation function
+        self.__flat = []
+        self.__bits = None # BitMemory, see use_bitset
+        self.__budget = None
+        self.__partial = None
+        self.__cache = None # ResultCache, see use_cache
+        self.__strata = None # (version, strata), see strata
+        self.stratified = False # fw_bfs evaluates the kb stratum by stratum
+        self.horn_fastpath = False # crisp saturation: linear Horn engine
+        self.fail_first = True # bw: premises likely to fail are tried first
+        self.__depth = None # (version, userid -> depth), see __depths
+        self.stats = None # RuleStats, see stats.py
+        self.__masks = {} # userid -> bitset of the atoms it may rest on
+        self.__supportOK = True # False: rebuilt at the next use (bw)
+        self.__trueMask = None # bitset of the true facts during bw_dfs
+        self.checkpoint = None # Checkpoint, saves the state while running
+        self.__run = None # (regime, memory) of the current resolution
+        self.__result = None # last entry recorded or replayed
         
     def clear(self):
         """ reset main variables """
         self.__symbTab.clear()
         self.__reverseSym.clear()
         self.__negation.clear()
+        self.__positives.clear()
+        self.__negatives.clear()
+        self.__fresh.clear()
         self.__rules.clear()
         self.__base.clear()
         self.__query.clear()
         self.__diag.clear()
+        self.__stamp.clear()
         self.__inconsistance = False
+        self.__trace.clear()
+        self.__conflict = None
+        self.__proof.clear()
+        self.__version += 1
+        self.close_parallel()
+        self.__compiled = None
+        self.__masks.clear()
+        self.__supportOK = True
         Fait.ID = Regle.ID = 0
 
     def __str__(self) -> str:
@@ -182,7 +652,7 @@ class Calcul:
         """
         _s = ''
         _s += "Règles\n"
-        for r in self.__rules:
+        for r in self.__rules.values():
             _s += str(r) + '\n'
         _s += "Faits connus\n"
         for k in self.__base:
@@ -202,22 +672,120 @@ class Calcul:
             _nf = Fait()
             self.__symbTab[key] = _nf
             self.__reverseSym[_nf.idnum] = key
+            if key.startswith(tuple(self.__neg)): self.__negatives.add(key)
+            else: self.__positives.add(key)
+            self.__fresh.append(key)
         return self.__symbTab[key]
     
-    def add_regle(self, regle:str) -> None:
+    def add_regle(self, regle:str, idnum:int=None) -> int:
         """ regle a1 & a2 & .. & an -> c 
         ensure that new facts are created and stored
         ensure that fact is updated when appearing in a rule
+        idnum: forced identifier, must be unused
+        :return: idnum of the new rule
         """
+        if idnum is not None and idnum in self.__rules:
+            raise ValueError("rule {} already exists".format(idnum))
         _g, _d, fiab = parseRule(regle)
         _left = [ self.__find_fact(x).idnum for x in _g ]
         _right = [ self.__find_fact(x).idnum  for x in _d ]
-        _nRule = Regle(_left, _right, fiab)
-        self.__rules.append(_nRule)
+        _nRule = Regle(_left, _right, fiab, idnum)
+        self.__rules[_nRule.idnum] = _nRule
         for x in set(_g):
             self.__symbTab[x].gauche.append(_nRule.idnum)
         for x in set(_d):
             self.__symbTab[x].droite.append(_nRule.idnum)
+        self.__version += 1
+        self.__compiled = None # back to the interpreted path
+        self.__supportOK = False # built by the next bw_dfs
+        return _nRule.idnum
+
+    def remove_regle(self, idnum:int) -> bool:
+        """ forget rule idnum, False if there is no such rule
+            ensure facts no longer refer to it
+        """
+        _r = self.__rules.pop(idnum, None)
+        if _r is None: return False
+        for x in _r.gauche:
+            self.__symbTab[self.get_useridFact(x)].gauche.remove(idnum)
+        for x in _r.droite:
+            self.__symbTab[self.get_useridFact(x)].droite.remove(idnum)
+        self.__supportOK = False
+        self.__version += 1
+        self.__compiled = None
+        return True
+
+    def optimize(self, remove:bool=True, subsumption:bool=True) -> dict:
+        """ static clean up of the rules
+            - duplicates: same premises, same conclusion, same fiabilite
+            - subsumed: a rule with fewer premises, same conclusion and
+              at least the same fiabilite exists
+            - dead: a premise can never be established from the base,
+              the askable facts and the rules, or premises are opposed
+            remove: False only flags them
+            subsumption: False keeps duplicates and subsumed rules, when
+              several rules are combined as evidence (Mycin)
+            the idnums of the remaining rules are unchanged
+            :return: report, removed idnum -> idnum kept in its place
+        """
+        _total = len(self.__rules)
+        _dup, _sub = {}, {}
+        if subsumption:
+            _kept = {} # conclusion -> rules kept so far
+            for r in sorted(self.__rules.values(),
+                            key=lambda r: (len(r.gauche), -r.fiabilite,
+                                           r.idnum)):
+                _others = _kept.setdefault(r.droite, [])
+                for k in _others:
+                    if not k.gauche <= r.gauche: continue
+                    if k.fiabilite < r.fiabilite: continue
+                    if k.gauche == r.gauche and k.fiabilite == r.fiabilite:
+                        _dup[r.idnum] = k.idnum
+                    else: _sub[r.idnum] = k.idnum
+                    break
+                else: _others.append(r)
+        # atoms that may be established, with their opposites
+        _known = set(self.__base) | set(self.get_askableFacts())
+        _known |= {self.get_opposition(x) for x in _known} - {None}
+        _alive = [r for rid, r in self.__rules.items()
+                  if rid not in _dup and rid not in _sub]
+        _fired = set()
+        _changed = True
+        while _changed:
+            _changed = False
+            for r in _alive:
+                if r.idnum in _fired: continue
+                if all([self.get_useridFact(x) in _known
+                        for x in r.gauche]):
+                    _fired.add(r.idnum)
+                    _changed = True
+                    for c in self.get_useridList(r.droite):
+                        _known.add(c)
+                        _not = self.get_opposition(c)
+                        if _not is not None: _known.add(_not)
+        _dead = []
+        for r in _alive:
+            _left = self.get_useridList(r.gauche)
+            if (r.idnum not in _fired or
+                any([self.get_opposition(x) in _left for x in _left])):
+                _dead.append(r.idnum)
+        _removed = len(_dup) + len(_sub) + len(_dead)
+        if remove:
+            for rid in list(_dup) + list(_sub) + _dead:
+                self.remove_regle(rid)
+        _report = {'total': _total, 'duplicates': _dup, 'subsumed': _sub,
+                   'dead': sorted(_dead), 'removed': _removed,
+                   'ratio': _removed / _total if _total else 0.,
+                   'applied': remove}
+        print("optimize: {} duplicate(s), {} subsumed, {} dead,"
+              " {}/{} rule(s) {}".format(len(_dup), len(_sub), len(_dead),
+                                         _removed, _total,
+                                         "removed" if remove else "flagged"))
+        return _report
+
+    def get_regle(self, idnum:int) -> Regle:
+        """ access to some rule, None if unknown """
+        return self.__rules.get(idnum, None)
 
     def check_knowledge(self, keysymb:str) -> bool:
         """ check that keysymb is in base """
@@ -233,6 +801,7 @@ class Calcul:
         _f = self.__find_fact(keysymb)
         self.del_goal(keysymb)
         self.__base.add(keysymb)
+        self.__touch(keysymb)
         _okey = self.get_opposition(keysymb)
         if _okey is not None:
             self.del_goal(_okey)            
@@ -259,8 +828,64 @@ class Calcul:
         _f = self.__symbTab[keysymb]
         _f.valeur = val
         self.__updateNot(keysymb)
+        self.__touch(keysymb)
         return self.check_knowledge(keysymb)
             
+    def __touch(self, keysymb:str) -> None:
+        """ remember when keysymb changed, for recency """
+        self.__tick += 1
+        self.__stamp[keysymb] = self.__tick
+
+    def set_facts(self, names, values) -> None:
+        """ bulk add_knowledge + change_knowledge
+            names: sequence of userid, values: sequence, array or
+            numpy array of beliefs; goals, base, opposites and recency
+            are updated once for the whole batch
+        """
+        names = list(names)
+        values = values.tolist() if hasattr(values, 'tolist') else list(values)
+        if len(names) != len(values):
+            raise ValueError("{} names for {} values"
+                             "".format(len(names), len(values)))
+        _tab = self.__symbTab
+        _facts = [_tab[k] if k in _tab else self.__find_fact(k)
+                  for k in names]
+        _pairs = self.__negation.pairs(names)
+        _keys = names + [o for _, o in _pairs]
+        self.__query.difference_update(_keys)
+        self.__base.update(_keys)
+        for f, v in zip(_facts, values): f.valeur = v
+        for k, o in _pairs: _tab[o].valeur = - _tab[k].valeur
+        self.__tick += 1
+        self.__stamp.update(dict.fromkeys(names, self.__tick))
+        self._after_set(_keys)
+
+    def _after_set(self, names:list) -> None:
+        """ hook: names (and their opposites) were changed by set_facts """
+        pass
+
+    def get_facts(self, names=None, numpy:bool=None):
+        """ beliefs of names (every symbol by default) in a contiguous
+            array('d'); numpy: a numpy view on that buffer, no copy,
+            None uses numpy when it is installed
+        """
+        _tab = self.__symbTab
+        _facts = (_tab.values() if names is None
+                  else [_tab[k] for k in names])
+        _out = array('d', [f.valeur for f in _facts])
+        if numpy is False: return _out
+        try:
+            import numpy as np
+        except ImportError:
+            if numpy: raise
+            return _out
+        return np.frombuffer(_out, dtype=np.float64)
+
+    def get_recency(self, left:set) -> int:
+        """ a set of int => time of the most recent change """
+        return max([self.__stamp.get(_, 0)
+                    for _ in self.get_useridList(left)])
+
     def reset_knowledge(self) -> None:
         """
            remove any information stored in base
@@ -295,12 +920,12 @@ class Calcul:
             :return:  0 partial failure (opposition)
             :return: -1 total failure (creation+opposition)
         """
+        self.__version += 1
         # aucun n'existe
         if key1 not in self.__symbTab and key2 not in self.__symbTab:
             _a = self.__find_fact(key1)
             _b = self.__find_fact(key2)
-            self.__negation[key1] = key2
-            self.__negation[key2] = key1
+            self.__negation.bind(key1, key2)
             return self.__check_consistancy(key1, key2)
         # 2 existent
         if key1 in self.__symbTab and key2 in self.__symbTab:
@@ -316,23 +941,20 @@ class Calcul:
                 _fa.valeur = - _fb.valeur
             elif _fa.discret() == _fb.discret():
                 _fa.valeur = _fb.valeur = 0
-            self.__negation[key1] = key2
-            self.__negation[key2] = key1
+            self.__negation.bind(key1, key2)
             return self.__check_consistancy(key1, key2)
         # 1 existe
         if key1 in self.__symbTab:
             if key1 in self.__negation: return -1
             _f = self.__find_fact(key2)
             _f.valeur = - self.__symbTab[key1].valeur
-            self.__negation[key1] = key2
-            self.__negation[key2] = key1
+            self.__negation.bind(key1, key2)
             return self.__check_consistancy(key1, key2)
         if key2 in self.__symbTab:
             if key2 in self.__negation: return -1
             _f = self.__find_fact(key1)
             _f.valeur = - self.__symbTab[key2].valeur
-            self.__negation[key1] = key2
-            self.__negation[key2] = key1
+            self.__negation.bind(key1, key2)
             return self.__check_consistancy(key1, key2)
 
     def __updateNot(self, keysymb:str) -> None:
@@ -395,6 +1017,11 @@ class Calcul:
         """ needed for local failure """
         return list(self.__query)
     #==================== résolution ======================================#
+    @property
+    def version(self) -> int:
+        """ changes each time rules or oppositions change """
+        return self.__version
+
     @property
     def inconsistance(self):
         """ flag for inconsistency """
@@ -403,19 +1030,187 @@ class Calcul:
     def inconsistance(self, v):
         """ set a boolean to inconstency flag """
         self.__inconsistance = bool(v)
+
+    def get_conflict(self) -> tuple:
+        """ None or (base facts, rule idnums) responsible for the last
+            inconsistency, both are frozensets
+        """
+        return self.__conflict
+
+    def __fired(self, rule:Regle, atom:str) -> None:
+        """ bookkeeping for a rule whose conclusion is established """
+        self.__trace.setdefault(atom, rule.idnum)
+        self.__proof.add(rule.idnum, atom, self.get_useridList(rule.gauche))
+        if self.__metrics is not None: self.__metrics.fired += 1
+
+    def rule_text(self, rule:Regle) -> str:
+        """ "a & b -> c" with sorted premises, the key of RuleStats """
+        return "{} -> {}".format(
+            " & ".join(sorted(self.get_useridList(rule.gauche))),
+            " & ".join(sorted(self.get_useridList(rule.droite))))
+
+    def __learn(self, rule:Regle, success:bool, cost:int=1) -> None:
+        if self.stats is not None:
+            self.stats.record(self.rule_text(rule), success, cost)
+
+    @property
+    def proof(self) -> Preuve:
+        """ proof graph of the last resolution """
+        return self.__proof
+
+    def why(self, atom:str) -> list:
+        """ rules and premises which established atom """
+        return self.__proof.why(atom)
+
+    def how_many_derivations(self, atom:str) -> int:
+        """ distinct derivations of atom in the last resolution """
+        return self.__proof.how_many_derivations(atom)
+
+    def __support(self, atoms:list) -> tuple:
+        """ walk back the trace: base facts and rules behind atoms """
+        _facts, _rules = set(), set()
+        _seen = set()
+        while atoms != []:
+            _k = atoms.pop()
+            if _k in _seen: continue
+            _seen.add(_k)
+            _rid = self.__trace.get(_k, None)
+            if _rid is None: _facts.add(_k) ; continue
+            _rules.add(_rid)
+            atoms.extend(self.get_useridList(self.__rules[_rid].gauche))
+        return frozenset(_facts), frozenset(_rules)
+
+    def __explain(self, rule:Regle, atom:str) -> tuple:
+        """ rule concludes atom whereas atom is false """
+        _not = self.get_opposition(atom)
+        _culprit = (_not if _not is not None and
+                    self.get_userFact(_not).discret() == 1 else atom)
+        _facts, _rules = self.__support(self.get_useridList(rule.gauche)
+                                        + [_culprit])
+        return _facts, _rules.union([rule.idnum])
+
+    def __set_conflict(self, rule:Regle, atom:str, meth:str) -> None:
+        """ flag the inconsistency and keep its explanation """
+        print("{}: Erreur !!!! Pb with {}".format(meth, atom))
+        self.__inconsistance = True
+        self.__conflict = self.__explain(rule, atom)
+        print("<!> conflict: faits {} règles {}"
+              "".format(sorted(self.__conflict[0]),
+                        sorted(self.__conflict[1])))
+
+    def __derivable_conflict(self, rids) -> Regle:
+        """ first rule in rids able to fire against a false conclusion """
+        for rid in sorted(rids):
+            r = self.__rules[rid]
+            _oname = self.get_useridList(r.droite)[0]
+            if self.get_userFact(_oname).discret() != -1: continue
+            if not all([self.get_useridFact(x) in self.__base
+                        for x in r.gauche]): continue
+            if self.get_evalLeft(r.gauche) == 1: return r
+        return None
+
+    def __watch(self, key:str) -> Regle:
+        """ rules touching key or its opposite that lead to a conflict """
+        _rids = set()
+        for k in (key, self.get_opposition(key)):
+            if k is None: continue
+            _rids.update(self.__symbTab[k].gauche)
+            _rids.update(self.__symbTab[k].droite)
+        return self.__derivable_conflict(_rids)
     
     def get_evalLeft(self, left:set) -> 'Number':
         """ a set of int => a value """
+        if self.__compiled is not None:
+            _fn = self.__compiled.get(left, None)
+            if _fn is not None: return _fn(self.__flat)
         return min([self.get_userFact(_).discret() 
                     for _ in self.get_useridList(left)])
+
+    #==================== compilation =====================================#
+    @staticmethod
+    def _source(premises:list, theta:float=.2) -> str:
+        """ python code: one function per left part
+            premises: list of tuple of slots in the flat array
+        """
+        _src = "# generated by Calcul.compile, do not edit\n"
+        for i, slots in enumerate(premises):
+            _src += "def _e{}(F):\n".format(i)
+            for j, k in enumerate(slots):
+                _src += "    _v = F[{}].valeur\n".format(k)
+                _src += "    if _v < -{}: return -1\n".format(theta)
+                if j == 0: _line = "    _m = 1 if _v > {} else 0\n"
+                else: _line = "    if _v <= {}: _m = 0\n"
+                _src += _line.format(theta)
+            _src += "    return _m\n"
+        _src += "TABLE = [{}]\n".format(
+            ', '.join(["_e{}".format(i) for i in range(len(premises))]))
+        return _src
+
+    @staticmethod
+    def _private_dir(path:str) -> bool:
+        """ create path (0o700) if needed
+            :return: True if only its owner, the current user, can write
+                     in it, so that the code cached there can be trusted
+        """
+        try:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+            _st = os.stat(path)
+        except OSError: return False
+        if not hasattr(os, 'getuid'): return True # no posix owner
+        return _st.st_uid == os.getuid() and not _st.st_mode & 0o022
+
+    def compile(self, cache_dir:str=None) -> str:
+        """ generate specialized evaluation functions for the left parts
+            the code object is cached on disk, keyed by the base's hash,
+            in cache_dir (default ~/.cache/calcul_compiled) if it is
+            private to the current user
+            any add_regle falls back to the interpreted path
+            :return: the key of the compiled module
+        """
+        _slot = {f.idnum: i for i, f in enumerate(self.__symbTab.values())}
+        _lefts = list({r.gauche: None for r in self.__rules.values()})
+        _premises = [tuple(sorted([_slot[x] for x in left]))
+                     for left in _lefts]
+        _src = self._source(_premises)
+        _key = hashlib.sha1(_src.encode()).hexdigest()
+        if cache_dir is None:
+            cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                                     os.path.expanduser('~/.cache'),
+                                     'calcul_compiled')
+        _path = os.path.join(cache_dir, "{}.{}.bin".format(
+            _key, sys.implementation.cache_tag))
+        _safe = self._private_dir(cache_dir)
+        try:
+            if not _safe: raise OSError("unsafe cache {}".format(cache_dir))
+            with open(_path, 'rb') as f: _code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            _code = compile(_src, "<calcul {}>".format(_key[:8]), 'exec')
+            try:
+                if _safe:
+                    with open(_path+'.tmp', 'wb') as f: marshal.dump(_code, f)
+                    os.replace(_path+'.tmp', _path)
+            except OSError: pass # no cache, still compiled
+        _env = {}
+        exec(_code, _env)
+        self.__flat = list(self.__symbTab.values())
+        self.__compiled = dict(zip(_lefts, _env['TABLE']))
+        return _key
+
+    @property
+    def compiled(self) -> bool:
+        """ True if get_evalLeft uses the generated code """
+        return self.__compiled is not None
     
     def get_useridList(self, fset: set) -> list:
         """ from a set of int find a list of userid """
         return [ self.get_useridFact(_) for _ in fset ]
             
-    def resolution(self, reg_mod:int, memory:bool) -> tuple:
+    def resolution(self, reg_mod:int, memory:bool,
+                   budget:Budget=None) -> tuple:
         """ 3 régimes, 2 modes
             memory: True on se rappelle les règles
+            budget: limits, when reached the run stops with a failure
+                    and get_partial() tells why
 
             :return: nb règles + success/failure
             print nb_call regle
@@ -425,14 +1220,166 @@ class Calcul:
         if reg_mod > 2:
             raise ValueError("This 'mini-kernel' do not provide "
                              "the mode {}".format(reg_mod))
+        _key = None
+        # stats: the ordering learned changes from one run to the next
+        if (self.__cache is not None and budget is None and
+            self.stats is None):
+            _key = self.__fingerprint(reg_mod, memory)
+            _entry = self.__cache.get(_key, self.__version)
+            if _entry is not None: return self.__replay(_entry)
+            _before = {k: f.valeur for k, f in self.__symbTab.items()}
         self.inconsistance = False
+        self.__trace = {}
+        self.__conflict = None
+        self.__proof.clear([x for x in self.__base
+                            if self.__symbTab[x].discret() == 1])
+        self.__partial = None
+        self.__budget = budget
+        if budget is not None: budget.start()
         _reg = "fw bw mix".split()
         _mod = "dfs bfs".split()
         if reg_mod in range(6):
             _0 = _reg[int(reg_mod/2)] # 0|1 -> 0, 2|3 -> 1, 3|4 -> 2
             _1 = _mod[reg_mod % 2] # odd -> 1, even -> 0
             _meth = "_{}__{}_{}".format('Calcul', _0, _1)
-            return getattr(self, _meth)(memory)
+            if _0 == 'fw' and self.__horn_ready(budget):
+                _meth = "_Calcul__fw_horn"
+            self.__run = (reg_mod, memory)
+            try:
+                _res = getattr(self, _meth)(memory)
+            finally:
+                self.__budget = None
+            if self.stats is not None: self.stats.run(reg_mod, _res[0])
+            if _key is not None:
+                self.__result = self.__record(_res, _before)
+                self.__cache.put(_key, self.__version, self.__result)
+            return _res
+
+    #================= checkpoint / resume =========================#
+    def __kb_signature(self) -> str:
+        """ rules and oppositions, a checkpoint needs the same kb """
+        _txt = ["{} {} {}".format(rid, self.rule_text(r), r.fiabilite)
+                for rid, r in sorted(self.__rules.items())]
+        _txt += sorted(["{}~{}".format(k, o) for k, o in
+                        self.__negation.pairs(self.__symbTab)])
+        return hashlib.sha1('\n'.join(_txt).encode()).hexdigest()
+
+    def __due(self, nbRules:int) -> bool:
+        """ cheap test, done before building the state for __save """
+        return self.checkpoint is not None and self.checkpoint.due(nbRules)
+
+    def __save(self, engine:str, nbRules:int, local:dict) -> None:
+        """ working memory + engine locals, the checkpoint is due """
+        _state = {'kb': self.__kb_signature(), 'engine': engine,
+                  'run': self.__run, 'local': local,
+                  'values': {k: f.valeur for k, f in self.__symbTab.items()},
+                  'base': sorted(self.__base), 'goals': sorted(self.__query),
+                  'stamp': dict(self.__stamp), 'tick': self.__tick,
+                  'diag': self.__diag.dump(), 'trace': dict(self.__trace),
+                  'proof': self.__proof.dump(),
+                  'inconsistance': self.inconsistance}
+        self.checkpoint.save(_state, nbRules)
+
+    def resume(self, src) -> tuple:
+        """ continue a resolution saved by a Checkpoint
+            src: path or bytes; the same kb must be loaded
+            :return: what resolution would have returned
+        """
+        _st = Checkpoint.load(src)
+        if _st['kb'] != self.__kb_signature():
+            raise ValueError("checkpoint taken on another knowledge base")
+        for k, v in _st['values'].items(): self.__find_fact(k).valeur = v
+        self.__base.clear()
+        for k in _st['base']: self.__base.add(k)
+        self.__query.clear()
+        for k in _st['goals']: self.__query.add(k)
+        self.__stamp, self.__tick = dict(_st['stamp']), _st['tick']
+        self.__diag.load(_st['diag'])
+        self.__trace = dict(_st['trace'])
+        self.__proof.load(_st['proof'])
+        self.inconsistance = _st['inconsistance']
+        self.__conflict = None
+        self.__partial = None
+        self.__run = _st['run']
+        _reg, _memory = self.__run
+        _res = getattr(self, _st['engine'])(_memory, _st['local'])
+        if self.stats is not None: self.stats.run(_reg, _res[0])
+        return _res
+
+    #================= result cache =========================#
+    def use_cache(self, size:int=128) -> None:
+        """ remember the outcome of resolution for a given working memory
+            size=0 switches the cache off; runs with a budget or with
+            stats are not cached
+        """
+        self.__cache = ResultCache(size) if size > 0 else None
+        self.__result = None
+
+    def cache_info(self) -> dict:
+        if self.__cache is None: return None
+        return {'hits': self.__cache.hits, 'misses': self.__cache.misses,
+                'size': len(self.__cache), 'maxsize': self.__cache.size}
+
+    def get_result(self) -> tuple:
+        """ (nbRules, success, new facts, trace) of the last resolution
+            only when the cache is on
+        """
+        if self.__result is None: return None
+        _res, _new, _trace, _ = self.__result
+        return _res[0], _res[1], list(_new), dict(_trace)
+
+    def __fingerprint(self, reg_mod:int, memory:bool) -> str:
+        """ stable over processes: kb version, facts, goals, options """
+        _values = sorted([(k, f.valeur) for k, f in self.__symbTab.items()
+                          if k in self.__base or f.valeur != 0])
+        _key = (self.__version, sorted(self.__base), _values,
+                sorted(self.__query), reg_mod, bool(memory),
+                self.strategy, self.early_conflict, self.stratified,
+                self.horn_fastpath, self.fail_first)
+        return hashlib.sha1(repr(_key).encode()).hexdigest()
+
+    def __record(self, res:tuple, before:dict) -> tuple:
+        """ the outcome and what changed in the working memory """
+        _changed = {k: f.valeur for k, f in self.__symbTab.items()
+                    if before.get(k, 0) != f.valeur}
+        _new = [k for k in _changed if before.get(k, 0) == 0]
+        _state = (frozenset(self.__base), frozenset(self.__query), _changed,
+                  self.inconsistance, self.__conflict, self.__partial,
+                  copy.deepcopy(self.__proof))
+        return tuple(res), _new, dict(self.__trace), _state
+
+    def __replay(self, entry:tuple) -> tuple:
+        """ a cache hit: working memory as if resolution had run """
+        _res, _, _trace, _state = entry
+        _base, _goals, _changed, _inc, _conflict, _partial, _proof = _state
+        for k, v in _changed.items(): self.__find_fact(k).valeur = v
+        self.__base.clear()
+        for k in _base: self.__base.add(k)
+        self.__query.clear()
+        for k in _goals: self.__query.add(k)
+        self.inconsistance = _inc
+        self.__trace = dict(_trace)
+        self.__conflict = _conflict
+        self.__partial = _partial
+        self.__proof = copy.deepcopy(_proof)
+        self.__result = entry
+        return _res
+
+    def get_partial(self) -> tuple:
+        """ None if the last resolution ran to its end
+            else (reason, facts established so far)
+        """
+        return self.__partial
+
+    def __spent(self, firings:int, agenda:int=0, memo:int=0) -> str:
+        """ reason to stop, None when there is no budget or within it """
+        if self.__budget is None: return None
+        return self.__budget.exceeded(firings, agenda, memo)
+
+    def __halt(self, reason:str, facts:list) -> None:
+        """ the budget is exhausted """
+        print("<!> budget exhausted ({}), partial result".format(reason))
+        self.__partial = (reason, list(facts))
 
     @staticmethod
     def res_summary(count:dict, facts:list,
@@ -458,18 +1405,34 @@ class Calcul:
 
         return _str
 
-    def __fw_dfs(self, memory:bool) -> tuple:
-        """ chaînage avant en profondeur d'abord """
-        _count = {}
-        _mem = set()
-        _newFacts = []
-        _nbRules = 0
-        _todo = self.selectableRules()
-        self.__diag.clear()
-        _saturation = len(self.__query) == 0
-        _fini = (_todo == [] if _saturation
-                            else len(self.__query) == 0)
-        _iter = 0 ; _changed = True
+    def __fw_dfs(self, memory:bool, state:dict=None) -> tuple:
+        """ chaînage avant en profondeur d'abord
+            state: locals saved by a checkpoint, see resume
+        """
+        _todo = Agenda(self, self.strategy)
+        if state is not None:
+            _count, _mem = state['count'], state['mem']
+            _newFacts, _nbRules = state['new'], state['nb']
+            _todo.load(state['todo'], self.__rules)
+            _saturation, _iter = state['saturation'], state['iter']
+            _changed, _fini = state['changed'], False
+        else:
+            _count = {}
+            _mem = set()
+            _newFacts = []
+            _nbRules = 0
+            _todo.push_all(self.selectableRules())
+            self.__diag.clear()
+            _saturation = len(self.__query) == 0
+            _fini = (len(_todo) == 0 if _saturation
+                                else len(self.__query) == 0)
+            _iter = 0 ; _changed = True
+        if self.early_conflict and state is None:
+            _r = self.__derivable_conflict([r.idnum for r in _todo])
+            if _r is not None:
+                self.__set_conflict(_r, self.get_useridList(_r.droite)[0],
+                                    "fw_dfs")
+                return _nbRules, False
 
         #================ le code ================================#
         while not _fini:
@@ -477,9 +1440,23 @@ class Calcul:
                 _iter += 1
                 print("Itération {:02d}".format(_iter), end = ': ')
             _changed = False
-            print("Pile des règles à traiter", [r.idnum for r in _todo])
-            if _todo == []: _fini = True ; continue
-            _r = _todo.pop(0)
+            _top = [r.idnum for r in _todo.peek(TRACE_TOP)]
+            print("Pile des règles à traiter",
+                  _top if len(_todo) <= TRACE_TOP else _top + ['...'])
+            if self.__metrics is not None:
+                self.__metrics.agenda.append(len(_todo))
+            if len(_todo) == 0: _fini = True ; continue
+            if self.__due(_nbRules):
+                self.__save("_Calcul__fw_dfs", _nbRules,
+                            {'count': _count, 'mem': _mem, 'new': _newFacts,
+                             'nb': _nbRules, 'todo': _todo.dump(),
+                             'saturation': _saturation, 'iter': _iter,
+                             'changed': _changed})
+            _why = self.__spent(_nbRules, len(_todo), len(_mem))
+            if _why is not None:
+                self.__halt(_why, _newFacts)
+                return _nbRules, False
+            _r = _todo.pop()
             if _r.idnum in _mem:
                 # mode monotomne, une règle déjà déclenchée n'ajoute rien
                 print("Rule {} already applied, ignore it".format(_r.idnum))
@@ -492,6 +1469,7 @@ class Calcul:
             if _v == 1: # la règle est utilisée
                 print("success")
                 self.__diag.add(_r.idnum, _oname, _v)
+                self.__learn(_r, True)
                 _count[_r.idnum] = _count.get(_r.idnum, 0) +1
                 if memory:
                     print(">>> Memorizing Rule {}".format(_r.idnum))
@@ -509,109 +1487,175 @@ class Calcul:
                     # maj -> comme si nouveau
                     if not _add: _add = True
                 elif _old == -1:
-                    print("fw_dfs: Erreur !!!! Pb with", _oname)
-                    self.__inconsistance = True
+                    self.__set_conflict(_r, _oname, "fw_dfs")
                     return _nbRules, False
                 else:
                     print("Value is already set for", _oname)
+                self.__fired(_r, _oname)
                 if _add: # on fait le travail demandé 
                     # un nouveau fait est "connu" -> règles
                     _newFacts.append(_oname)
                     _changed = True
                     self.change_knowledge(_oname, _v)
-                    for x in self.selectableRules()[::-1]:
-                        _todo.insert(0, x)
+                    if self.early_conflict:
+                        _w = self.__watch(_oname)
+                        if _w is not None:
+                            self.__set_conflict(
+                                _w, self.get_useridList(_w.droite)[0],
+                                "fw_dfs")
+                            return _nbRules, False
+                    _todo.push_all(self.selectableRules())
 
             else:
                 self.__diag.add_failure(_r.idnum, _oname)
+                self.__learn(_r, False)
                 print("failure")
                 
-            _fini = (_todo == [] if _saturation
+            _fini = (len(_todo) == 0 if _saturation
                                     else len(self.__query) == 0)
 
         #=============== diagnostic ==============================#
         _sum = self.res_summary(_count, _newFacts, self.get_goals(),
-                                _todo, _mem, "pile", "fw_dfs",
+                                _todo.in_order(), _mem, "pile", "fw_dfs",
                                 self.__diag)
         print(_sum)
         #===================== return ============================#
         return _nbRules, (_newFacts != [] if _saturation
                           else len(self.__query) == 0)
 
-    def __one_lvl(self, _todo:list, memory:bool) -> list:
+    def __one_lvl(self, _todo:list, memory:bool) -> tuple:
         """ all candidates rules are used at once 
             the facts collected are processed outside
+            :return: facts collected, None or why the budget stopped it
         """
         print("File des règles à traiter", [r.idnum for r in _todo])
         _foundFacts = []
+        _values = self.__layer_values(_todo)
         for rule in _todo:
             if rule.idnum in self.__mem:
                 print("Rule {} already applied, ignore it".format(rule.idnum))
                 continue
+            _why = self.__spent(self.__nbRules, len(_todo), len(self.__mem))
+            if _why is not None: return _foundFacts, _why
             print(">>> Trigger R{:02}".format(rule.idnum),
                   end = ' .. ')
             self.__nbRules += 1
             self.__count[rule.idnum] = self.__count.get(rule.idnum, 0)+1
-            _v = self.get_evalLeft(rule.gauche)
+            _v = _values.get(rule.idnum, None)
+            if _v is None: _v = self.get_evalLeft(rule.gauche)
             _oname = self.get_useridList(rule.droite)[0]
+            self.__learn(rule, _v == 1)
             if _v == 1: # Règle utilisée
                 self.__diag.add(rule.idnum, _oname, _v)
                 if memory:
                     print("success\n>>> Memorizing Rule {}".format(rule.idnum))
                     self.__mem.add(rule.idnum)
                 else: print("success")
-                _foundFacts.append(_oname)
+                _foundFacts.append((rule, _oname))
             else:
                 self.__diag.add_failure(rule.idnum, _oname)
                 print("failure")
-        return _foundFacts
+        return _foundFacts, None
+
+    def __delta_rules(self, delta:set) -> list:
+        """ semi-naive step: selectable rules using or concluding
+            a fact of delta, in rule order
+        """
+        _rids = set()
+        for k in delta:
+            _rids.update(self.__symbTab[k].gauche)
+            _rids.update(self.__symbTab[k].droite)
+        return self.__applicable(sorted(_rids))
+
+    def __applicable(self, rids:list) -> list:
+        """ rules of rids whose premises are all in base """
+        _rules = []
+        for rid in rids:
+            r = self.__rules[rid]
+            if all([self.get_useridFact(x) in self.__base
+                    for x in r.gauche]): _rules.append(r)
+        return _rules
+
+    _PARALLEL_MIN = 512 # smaller layers are not worth the pool
+
+    def __layer_values(self, todo:list) -> dict:
+        """ rule idnum -> get_evalLeft computed by the process pool
+            empty when the layer is evaluated sequentially
+        """
+        if (not self.parallel or len(todo) < self._PARALLEL_MIN or
+            type(self).get_evalLeft is not Calcul.get_evalLeft):
+            return {}
+        if self.__layer is None or self.__layer[0] != self.__version:
+            from parallel import ParallelLayer
+            self.close_parallel()
+            self.__layer = (self.__version,
+                            ParallelLayer(list(self.__symbTab.values()),
+                                          list(self.__rules.values()),
+                                          self.parallel))
+        return self.__layer[1].evaluate([r for r in todo
+                                         if r.idnum not in self.__mem])
+
+    def close_parallel(self) -> None:
+        """ release the process pool used by fw_bfs """
+        if self.__layer is not None:
+            self.__layer[1].close()
+            self.__layer = None
 
-    def __fw_bfs(self, memory:bool) -> tuple:
+    def __fw_bfs(self, memory:bool, state:dict=None) -> tuple:
         """ chainage avant en largeur d'abord 
             on fait le parcours horizontal, on collecte les faits
-            on lance un seul selectRules
+            semi-naive: after the first cycle, only rules touching
+            the facts changed during the previous cycle are evaluated
         """
-        self.__count = {}
-        self.__mem = set()
-        _newFacts = []
-        self.__nbRules = 0
-        self.__diag.clear()
-        _todo = self.selectableRules()
-        _changed = True
-        _saturation = len(self.__query) == 0
-        _fini = (_todo == [] if _saturation
-                            else len(self.__query) == 0)
+        if state is not None:
+            self.__count, self.__mem = state['count'], state['mem']
+            _newFacts, self.__nbRules = state['new'], state['nb']
+            _todo = [self.__rules[rid] for rid in state['todo']]
+            _saturation, _cycle = state['saturation'], state['cycle']
+            _changed, _fini = True, False
+        elif self.stratified and self.checkpoint is None:
+            return self.__fw_strata(memory)
+        else:
+            self.__count = {}
+            self.__mem = set()
+            _newFacts = []
+            self.__nbRules = 0
+            self.__diag.clear()
+            _todo = ordered(self, self.selectableRules(), self.strategy)
+            _changed = True
+            _saturation = len(self.__query) == 0
+            _fini = (_todo == [] if _saturation
+                                else len(self.__query) == 0)
+            _cycle = 0
 
         #================ le code ================================#
-        _cycle = 0
+        if self.early_conflict and state is None:
+            _r = self.__derivable_conflict([r.idnum for r in _todo])
+            if _r is not None:
+                self.__set_conflict(_r, self.get_useridList(_r.droite)[0],
+                                    "fw_bfs")
+                return self.__nbRules, False
         while _changed and not _fini:
+            if self.__due(self.__nbRules):
+                self.__save("_Calcul__fw_bfs", self.__nbRules,
+                            {'count': self.__count, 'mem': self.__mem,
+                             'new': _newFacts, 'nb': self.__nbRules,
+                             'todo': [r.idnum for r in _todo],
+                             'saturation': _saturation, 'cycle': _cycle})
             _cycle += 1
             print("#{0} Début cycle {1:02d} {0}#".format('-'*7, _cycle))
-            _ = self.__one_lvl(_todo, memory)
-            _changed = False
-            for _oname in _: # traitement des informations
-                _add = False
-                if not self.check_knowledge(_oname):
-                    _changed = True
-                    _add = True
-                    _newFacts.append(_oname)
-                    self.add_knowledge(_oname)
-                else: _add = False
-                _old = self.get_userFact(_oname).discret()
-                if _old == 0:
-                    print('update value for', _oname)
-                    self.change_knowledge(_oname, 1)
-                    # maj -> comme si nouveau
-                    _changed = True
-                    if not _add : _newFacts.append(_oname)
-                elif _old == -1:
-                    print("fw_bfs: Erreur !!!! Pb with", _oname)
-                    self.__inconsistance = True
-                    return self.__nbRules, False
-                else:
-                    print("Value is already set for", _oname)
+            if self.__metrics is not None:
+                self.__metrics.agenda.append(len(_todo))
+            _, _why = self.__one_lvl(_todo, memory)
+            _delta = self.__absorb(_, _newFacts, "fw_bfs")
+            if _delta is None: return self.__nbRules, False
+            if _why is not None:
+                self.__halt(_why, _newFacts)
+                return self.__nbRules, False
+            _changed = _delta != set()
 
-            _todo = self.selectableRules() if _changed else []
+            _todo = (ordered(self, self.__delta_rules(_delta), self.strategy)
+                     if _changed else [])
             _fini = (_todo == [] if _saturation
                             else len(self.__query) == 0)
                 
@@ -626,8 +1670,231 @@ class Calcul:
         return self.__nbRules, (_newFacts != [] if _saturation
                           else len(self.__query) == 0)
 
-    def __bw_dfs(self, avecMem:bool) -> (int, bool):
-        """ chainage arrière en profondeur d'abord """
+    def __absorb(self, found:list, newFacts:list, meth:str) -> set:
+        """ store the facts collected by __one_lvl
+            :return: the facts changed and their opposites, None on conflict
+        """
+        _delta = set()
+        for _r, _oname in found: # traitement des informations
+            _add = False
+            if not self.check_knowledge(_oname):
+                _add = True
+                newFacts.append(_oname)
+                self.add_knowledge(_oname)
+            _old = self.get_userFact(_oname).discret()
+            if _old == 0:
+                print('update value for', _oname)
+                self.change_knowledge(_oname, 1)
+                # maj -> comme si nouveau
+                if not _add : newFacts.append(_oname)
+            if _add or _old == 0:
+                _delta.add(_oname)
+                _not = self.get_opposition(_oname)
+                if _not is not None: _delta.add(_not)
+            elif _old == -1:
+                self.__set_conflict(_r, _oname, meth)
+                return None
+            else:
+                print("Value is already set for", _oname)
+            self.__fired(_r, _oname)
+            if self.early_conflict and (_add or _old == 0):
+                _w = self.__watch(_oname)
+                if _w is not None:
+                    self.__set_conflict(
+                        _w, self.get_useridList(_w.droite)[0], meth)
+                    return None
+        return _delta
+
+    #================= stratification =========================#
+    def strata(self) -> list:
+        """ strongly connected components of the rule dependency graph
+            in topological order: [(idnums, cyclic)]
+            r1 -> r2 when r2 uses the conclusion of r1 or its opposite
+            cached until the knowledge base changes
+        """
+        if self.__strata is not None and self.__strata[0] == self.__version:
+            return self.__strata[1]
+        _succ = {}
+        for rid, r in self.__rules.items():
+            _succ[rid] = set()
+            for c in self.get_useridList(r.droite):
+                _succ[rid].update(self.__symbTab[c].gauche)
+                _not = self.get_opposition(c)
+                if _not is not None:
+                    _succ[rid].update(self.__symbTab[_not].gauche)
+        _strata = [(sorted(comp),
+                    len(comp) > 1 or comp[0] in _succ[comp[0]])
+                   for comp in reversed(self.__tarjan(_succ))]
+        self.__strata = self.__version, _strata
+        return _strata
+
+    @staticmethod
+    def __tarjan(succ:dict) -> list:
+        """ iterative Tarjan, components in reverse topological order """
+        _index, _low = {}, {}
+        _stack, _onstack, _comps = [], set(), []
+        _n = 0
+        for root in succ:
+            if root in _index: continue
+            _work = [(root, iter(sorted(succ[root])))]
+            _index[root] = _low[root] = _n ; _n += 1
+            _stack.append(root) ; _onstack.add(root)
+            while _work:
+                v, it = _work[-1]
+                for w in it:
+                    if w not in _index:
+                        _index[w] = _low[w] = _n ; _n += 1
+                        _stack.append(w) ; _onstack.add(w)
+                        _work.append((w, iter(sorted(succ[w]))))
+                        break
+                    if w in _onstack: _low[v] = min(_low[v], _index[w])
+                else:
+                    _work.pop()
+                    if _work:
+                        u = _work[-1][0]
+                        _low[u] = min(_low[u], _low[v])
+                    if _low[v] == _index[v]:
+                        _comp = []
+                        while True:
+                            w = _stack.pop() ; _onstack.discard(w)
+                            _comp.append(w)
+                            if w == v: break
+                        _comps.append(_comp)
+        return _comps
+
+    def __fw_strata(self, memory:bool) -> tuple:
+        """ chaînage avant par strates
+            an acyclic stratum is evaluated once, its premises are
+            final; the fixpoint is only iterated inside cyclic strata
+        """
+        self.__count = {}
+        self.__mem = set()
+        _newFacts = []
+        self.__nbRules = 0
+        self.__diag.clear()
+        _saturation = len(self.__query) == 0
+        _todo = []
+        if self.early_conflict:
+            _r = self.__derivable_conflict([r.idnum for r in
+                                            self.selectableRules()])
+            if _r is not None:
+                self.__set_conflict(_r, self.get_useridList(_r.droite)[0],
+                                    "fw_strata")
+                return self.__nbRules, False
+        for _k, (_rids, _cyclic) in enumerate(self.strata()):
+            if not _saturation and len(self.__query) == 0: break
+            _changed = True
+            while _changed:
+                _todo = ordered(self, self.__applicable(_rids),
+                                self.strategy)
+                if _todo == []: break
+                print("#{0} Strate {1:02d}{2} {0}#".format(
+                    '-'*7, _k, " (cycle)" if _cyclic else ""))
+                if self.__metrics is not None:
+                    self.__metrics.agenda.append(len(_todo))
+                _, _why = self.__one_lvl(_todo, memory)
+                _delta = self.__absorb(_, _newFacts, "fw_strata")
+                if _delta is None: return self.__nbRules, False
+                if _why is not None:
+                    self.__halt(_why, _newFacts)
+                    return self.__nbRules, False
+                _changed = _cyclic and _delta != set()
+            _todo = []
+
+        #=============== diagnostic ==============================#
+        _sum = self.res_summary(self.__count, _newFacts,
+                                self.get_goals(),
+                                _todo, self.__mem, "strate", "fw_strata",
+                                self.__diag)
+        print(_sum)
+        #===================== return ============================#
+        return self.__nbRules, (_newFacts != [] if _saturation
+                          else len(self.__query) == 0)
+
+    #================= Horn fast path =========================#
+    def is_crisp(self) -> bool:
+        """ every rule is certain and every belief is -1, 0 or 1 """
+        return (all([r.fiabilite == 1 for r in self.__rules.values()]) and
+                all([f.valeur in (-1, 0, 1)
+                     for f in self.__symbTab.values()]))
+
+    def __horn_ready(self, budget:Budget) -> bool:
+        """ the forward chaining may use __fw_horn: opt-in, saturation
+            only, nbRules and the Diagnostic are those of __fw_horn
+        """
+        return (self.horn_fastpath and budget is None and
+                len(self.__query) == 0 and
+                self.checkpoint is None and
+                not self.early_conflict and not self.stratified and
+                type(self).get_evalLeft is Calcul.get_evalLeft and
+                self.is_crisp())
+
+    def __fw_horn(self, memory:bool) -> tuple:
+        """ saturation en temps linéaire (Dowling-Gallier)
+            a counter of premises not yet true per rule, a rule fires
+            once when its counter reaches 0; same facts, conflicts and
+            success as a saturation by fw_dfs, but each rule counts
+            once in nbRules and failures are listed once at the end
+        """
+        self.__diag.clear()
+        _count = {}
+        _newFacts = []
+        _fired = set()
+        _true = lambda k: (k in self.__base and
+                           self.__symbTab[k].discret() == 1)
+        _sat = set([k for k in self.__base if _true(k)]) # counted premises
+        _missing = {}
+        _ready = deque()
+        for rid, r in self.__rules.items():
+            _missing[rid] = len([x for x in self.get_useridList(r.gauche)
+                                 if x not in _sat])
+            if _missing[rid] == 0: _ready.append(r)
+        print("File des règles à traiter", [r.idnum for r in _ready])
+        while _ready:
+            _r = _ready.popleft()
+            _fired.add(_r.idnum)
+            _count[_r.idnum] = 1
+            _oname = self.get_useridList(_r.droite)[0]
+            print(">> Trigger R{:02d} .. success".format(_r.idnum))
+            self.__diag.add(_r.idnum, _oname, 1)
+            if not self.check_knowledge(_oname):
+                print("New Fact", _oname)
+                self.add_knowledge(_oname)
+            _old = self.get_userFact(_oname).discret()
+            if _old == -1:
+                self.__set_conflict(_r, _oname, "fw_horn")
+                return len(_fired), False
+            self.__fired(_r, _oname)
+            if _old == 1:
+                print("Value is already set for", _oname)
+            else:
+                print('update value for', _oname)
+                self.change_knowledge(_oname, 1)
+                _newFacts.append(_oname)
+            # true and in base for the first time: its users progress
+            if _oname in _sat: continue
+            _sat.add(_oname)
+            for rid in self.__symbTab[_oname].gauche:
+                _missing[rid] -= 1
+                if _missing[rid] == 0: _ready.append(self.__rules[rid])
+        for r in self.selectableRules():
+            if r.idnum not in _fired:
+                self.__diag.add_failure(r.idnum,
+                                        self.get_useridList(r.droite)[0])
+
+        #=============== diagnostic ==============================#
+        _sum = self.res_summary(_count, _newFacts, self.get_goals(),
+                                list(_ready), _fired if memory else set(),
+                                "file", "fw_horn", self.__diag)
+        print(_sum)
+        #===================== return ============================#
+        return len(_fired), _newFacts != []
+
+    def __bw_dfs(self, avecMem:bool, state:dict=None) -> (int, bool):
+        """ chainage arrière en profondeur d'abord
+            state: saved by a checkpoint, between two top-level goals
+        """
+        if state is not None: return self.__bw_goals(avecMem, state)
         _targets = self.get_goals()
         _proof = {x:[] for x in (True, False)}
         # as lit and non-lit are bound we need to clean the mess
@@ -649,8 +1916,19 @@ class Calcul:
         self.__mem = {}
         self.__diag.clear()
         self.__nbR = 0
+        if self.checkpoint is not None:
+            return self.__bw_goals(avecMem, {'targets': _proof[True],
+                                             'done': 0})
+        self.__supports()
+        self.__trueMask = self.__true_mask()
         #================ le code ================================#
-        _success = self.__noeudET(_proof[True][:], 0, [], avecMem)
+        try:
+            _success = self.__noeudET(_proof[True][:], 0, [], avecMem)
+        except BudgetExceeded as _e:
+            self.__halt(str(_e), self.__proof.derived())
+            return self.__nbR, False
+        finally:
+            self.__trueMask = None
         #=============== diagnostic ==============================#
         _sum = self.res_summary(self.__count, [], _proof[True],
                                   [], self.__mem, "pile", "bw_dfs",
@@ -659,6 +1937,40 @@ class Calcul:
         #===================== return ============================#
         return self.__nbR, _success
 
+    def __bw_goals(self, avecMem:bool, state:dict) -> (int, bool):
+        """ bw_dfs one top-level goal at a time, a checkpoint may be
+            saved before each of them
+        """
+        _targets = state['targets']
+        if 'nb' in state:
+            self.__count, self.__mem = state['count'], state['mem']
+            self.__nbR = state['nb']
+        self.__supports()
+        self.__trueMask = self.__true_mask()
+        _success = True
+        try:
+            for i in range(state['done'], len(_targets)):
+                if self.__due(self.__nbR):
+                    self.__save("_Calcul__bw_dfs", self.__nbR,
+                                {'targets': _targets, 'done': i,
+                                 'count': self.__count, 'mem': self.__mem,
+                                 'nb': self.__nbR})
+                if not self.__noeudET(_targets[i:i+1], 0, [], avecMem):
+                    _success = False
+                    break
+        except BudgetExceeded as _e:
+            self.__halt(str(_e), self.__proof.derived())
+            return self.__nbR, False
+        finally:
+            self.__trueMask = None
+        #=============== diagnostic ==============================#
+        _sum = self.res_summary(self.__count, [], _targets,
+                                [], self.__mem, "pile", "bw_dfs",
+                                self.__diag)
+        print(_sum)
+        #===================== return ============================#
+        return self.__nbR, _success
+
     def __noeudET(self, buts:list, nbRegles:int,
                   branch:list, avecMem:bool) -> bool:
         """ un noeud ET échoue si l'un des buts échoue """
@@ -671,6 +1983,101 @@ class Calcul:
             return self.__noeudET(buts[1:], nbRegles, branch, avecMem)
         else: return False
 
+    #================= support index =========================#
+    def __leaf(self, key:str) -> int:
+        return self.__masks.get(key, 1 << self.__symbTab[key].idnum)
+
+    def __spread(self, rule:Regle) -> None:
+        """ the conclusions of rule rest on the supports of its
+            premises, and so do the atoms depending on them
+        """
+        _mask = 0
+        for x in self.get_useridList(rule.gauche): _mask |= self.__leaf(x)
+        _todo = [(c, _mask) for c in self.get_useridList(rule.droite)]
+        while _todo:
+            c, _mask = _todo.pop()
+            _old = self.__leaf(c)
+            if _old | _mask == _old: continue
+            self.__masks[c] = _old | _mask
+            for rid in self.__symbTab[c].gauche:
+                for d in self.get_useridList(self.__rules[rid].droite):
+                    _todo.append((d, _old | _mask))
+
+    def __supports(self) -> dict:
+        """ the index, rebuilt after a change of the rules
+            strata in topological order: the premises of an acyclic
+            stratum are complete, only cycles need __spread
+        """
+        if not self.__supportOK:
+            self.__masks.clear()
+            self.__supportOK = True
+            for rids, cyclic in self.strata():
+                for rid in rids:
+                    r = self.__rules[rid]
+                    if cyclic:
+                        self.__spread(r)
+                        continue
+                    _mask = 0
+                    for x in self.get_useridList(r.gauche):
+                        _mask |= self.__leaf(x)
+                    for c in self.get_useridList(r.droite):
+                        self.__masks[c] = self.__leaf(c) | _mask
+        return self.__masks
+
+    def support(self, key:str) -> set:
+        """ atoms a proof of key may rest on, key included """
+        self.__supports()
+        _mask = self.__leaf(key)
+        return {k for k, f in self.__symbTab.items()
+                if _mask >> f.idnum & 1}
+
+    def __true_mask(self) -> int:
+        """ bitset of the facts known true """
+        _mask = 0
+        for k in self.__base:
+            _f = self.__symbTab[k]
+            if _f.discret() == 1: _mask |= 1 << _f.idnum
+        return _mask
+
+    def __depths(self) -> dict:
+        """ estimated proof depth of each atom, cached with the kb
+            0 when no rule concludes it, else 1 + the best rule's
+            deepest premise; atoms only provable through a cycle get
+            len(rules)
+        """
+        if self.__depth is not None and self.__depth[0] == self.__version:
+            return self.__depth[1]
+        _inf = len(self.__rules)
+        _depth = {k: (0 if not f.prouvable else _inf)
+                  for k, f in self.__symbTab.items()}
+        _changed = True
+        while _changed:
+            _changed = False
+            for r in self.__rules.values():
+                _d = 1 + max([_depth[self.get_useridFact(x)]
+                              for x in r.gauche])
+                for c in self.get_useridList(r.droite):
+                    if _d < _depth[c]:
+                        _depth[c] = _d
+                        _changed = True
+        self.__depth = self.__version, _depth
+        return _depth
+
+    def __schedule(self, buts:list, avecMem:bool) -> list:
+        """ fail first: known false, known true, unprovable, then the
+            others by estimated depth; ties keep their order
+        """
+        _depth = self.__depths()
+        def _rank(goal):
+            if self.check_knowledge(goal):
+                return (0 if self.get_userFact(goal).discret() != 1
+                        else 1), 0
+            if avecMem and goal in self.__mem:
+                return (1 if self.__mem[goal] else 0), 0
+            if not self.get_userFact(goal).prouvable: return 2, 0
+            return 3, _depth.get(goal, 0)
+        return sorted(buts, key=_rank)
+
     def __noeudOU(self, goal:str, nbRegles:int, branch, avecMem:bool) -> bool:
         """
         On regarde si le but est dans la base 
@@ -680,13 +2087,21 @@ class Calcul:
             if __debug__: print("{} is knowledge".format(goal))
             return self.get_userFact(goal).discret() == 1 # known fact
         if avecMem and goal in self.__mem:
+            if self.__metrics is not None: self.__metrics.memo_hits += 1
             if __debug__: print("{} already evaluated".format(goal))
             return self.__mem[goal]
         if nbRegles >= len(self.__rules):
             if __debug__: print("Loop detected, processus aborted")
             return False # loop detection
+        if (self.__trueMask is not None and
+            not self.__leaf(goal) & self.__trueMask):
+            if __debug__: print("{} rests on no true fact".format(goal))
+            if avecMem: self.__mem[goal] = False
+            return False
         success = False
         aTester = [self.__rules[x] for x in self.get_userFact(goal).droite]
+        if self.stats is not None:
+            aTester = self.stats.order(aTester, self.rule_text)
         while not success and aTester != []:
             r = aTester.pop(0) # 1ere regle
             if avecMem and r.idnum in branch:
@@ -694,25 +2109,84 @@ class Calcul:
                     print("R{:02d} already used in {}"
                           "".format(r.idnum, branch))
                 continue
+            _why = self.__spent(self.__nbR, 0, len(self.__mem))
+            if _why is not None: raise BudgetExceeded(_why)
             self.__nbR += 1
             if __debug__:
                 print("{} Try R{:02d}, pf = {}, total = {}"
                     "".format('>'*(nbRegles+1),
                               r.idnum, nbRegles+1, self.__nbR))
             nG = [self.get_useridFact(x) for x in r.gauche]
+            if self.fail_first: nG = self.__schedule(nG, avecMem)
             _nbr = branch[:]
             _nbr.append(r.idnum)
+            _cost = self.__nbR
             success = self.__noeudET(nG, nbRegles+1, _nbr, avecMem)
+            self.__learn(r, success, self.__nbR - _cost + 1)
             if avecMem: self.__mem[goal] = success
             if __debug__:
                 print("{} R{:02d} at pf = {}"
                       "".format("success" if success else "failed",
                                 r.idnum, nbRegles+1))
-            if success: self.__diag.add(r.idnum, goal, 1)
+            if success:
+                self.__diag.add(r.idnum, goal, 1)
+                self.__fired(r, goal)
             else: self.__diag.add_failure(r.idnum, goal)
 
         return success
     
+    #=================== instrumentation ==================================#
+    _PROBED = ('selectableRules', 'get_evalLeft', '_Calcul__find_fact',
+               'add_knowledge', 'change_knowledge')
+
+    def enable_metrics(self, on:bool=True) -> None:
+        """ install (or remove) the counters on the hot paths
+            nothing is paid while metrics are off
+        """
+        for name in self._PROBED: self.__dict__.pop(name, None)
+        if not on: self.__metrics = None ; return
+        self.__metrics = Metrics()
+        for name in self._PROBED:
+            setattr(self, name, self.__metrics.wrap(name.split('__')[-1],
+                                                    getattr(self, name)))
+        _select = self.selectableRules
+        def _scan():
+            self.__metrics.scanned += len(self.__rules)
+            return _select()
+        self.selectableRules = _scan
+
+    def metrics(self) -> dict:
+        """ snapshot of the counters, None if metrics are off """
+        if self.__metrics is None: return None
+        return self.__metrics.snapshot()
+
+    def reset_metrics(self) -> None:
+        """ counters back to 0 """
+        if self.__metrics is not None: self.__metrics.clear()
+
+    def profile(self, reg_mod:int, memory:bool,
+                tool:str='cProfile', sort:str='cumulative') -> tuple:
+        """ run resolution under a profiler
+            :return: result of resolution, profiler's report
+        """
+        if tool == 'cProfile':
+            import cProfile, io, pstats
+            _prof = cProfile.Profile()
+            _res = _prof.runcall(self.resolution, reg_mod, memory)
+            _out = io.StringIO()
+            pstats.Stats(_prof, stream=_out).sort_stats(sort).print_stats(25)
+            return _res, _out.getvalue()
+        if tool == 'pyinstrument':
+            from pyinstrument import Profiler # optional dependency
+            _prof = Profiler()
+            _prof.start()
+            try:
+                _res = self.resolution(reg_mod, memory)
+            finally:
+                _prof.stop()
+            return _res, _prof.output_text()
+        raise ValueError("unknown profiler {}".format(tool))
+
     #=================== display ==========================================#
     def show(self) -> None:
         """
@@ -722,16 +2196,72 @@ class Calcul:
             _f = self.__symbTab[k]
             print(k, "gauche {0.gauche}, droite {0.droite}".format(_f))
 
+    #==================== working memory as bitsets =======================#
+    def use_bitset(self, on:bool=True, numpy:bool=None) -> None:
+        """ mirror base and goals into bitsets (see bitset.py)
+            selectableRules/selectableProofs then check every rule
+            with AND/compare on masks, numpy is used when available
+        """
+        if not on:
+            self.__bits = None
+            self.__base = set(self.__base)
+            self.__query = set(self.__query)
+            return
+        from bitset import BitMemory, TrackedSet
+        _mem = BitMemory(numpy)
+        for k in self.__symbTab: _mem.index(k)
+        self.__base = TrackedSet(self.__base, _mem, 'base')
+        self.__query = TrackedSet(self.__query, _mem, 'goals')
+        self.__bits = _mem
+
+    def __bitmem(self):
+        """ masks are rebuilt when the rules have changed """
+        if self.__bits.version != self.__version:
+            self.__bits.load(self.__rules.values(), self.get_useridFact,
+                             self.__version)
+        return self.__bits
+
+    def snapshot(self) -> tuple:
+        """ working memory (base, goals, beliefs) for what-if forks
+            base and goals are two ints when bitsets are on
+        """
+        _values = tuple([f.valeur for f in self.__symbTab.values()])
+        if self.__bits is not None:
+            return self.__bits.snapshot() + (_values,)
+        return frozenset(self.__base), frozenset(self.__query), _values
+
+    def restore(self, snap:tuple) -> None:
+        """ back to a snapshot, facts created since then are reset to 0 """
+        _base, _goals, _values = snap
+        if isinstance(_base, int):
+            if self.__bits is None:
+                raise ValueError("bitset snapshot needs use_bitset()")
+            _base = self.__bits.keys_of(_base)
+            _goals = self.__bits.keys_of(_goals)
+        self.__base.clear()
+        for k in _base: self.__base.add(k)
+        self.__query.clear()
+        for k in _goals: self.__query.add(k)
+        _facts = list(self.__symbTab.values())
+        for f in _facts[len(_values):]: f.valeur = 0.
+        for f, v in zip(_facts, _values): f.valeur = v
+
     #==================== pick rules of interest =========================#
     def selectableRules(self) -> list:
         """ ordered list if Regle.gauche is in base """
+        if self.__bits is not None:
+            return self.__bitmem().applicable('left', 'base')
         _known = set([self.get_idnumFact(x) for x in self.__base])
-        return [r for r in self.__rules if r.gauche.issubset(_known) ]
+        return [r for r in self.__rules.values()
+                if r.gauche.issubset(_known) ]
 
     def selectableProofs(self) -> list:
         """ ordered list if Regle.droite is in goals """
+        if self.__bits is not None:
+            return self.__bitmem().applicable('right', 'goals')
         _goals = set([self.get_idnumFact(x) for x in self.__query])
-        return [r for r in self.__rules if r.droite.issubset(_goals) ]
+        return [r for r in self.__rules.values()
+                if r.droite.issubset(_goals) ]
 
     def __selectableQueries(self, rid:int) -> set:
         """ helper to select rules 
@@ -756,7 +2286,7 @@ class Calcul:
     def selectableQueries(self) -> list:
         """ return tuple rid, set(userid for query) """
         return [ (r.idnum, self.__selectableQueries(r.idnum))
-                 for r in self.__rules ]
+                 for r in self.__rules.values() ]
 
     def __buildContraposee(self, rid:int) -> str:
         """ helper for contraposée """
@@ -773,7 +2303,7 @@ class Calcul:
     def selectableContra(self) -> list:
         """ return tuples rid, None or rid, rule """
         return [ (r.idnum, self.__buildContraposee(r.idnum))
-                 for r in self.__rules ]
+                 for r in self.__rules.values() ]
 
     def __selectableNeg(self, rid:int) -> set:
         """ this is only for atoms with prefix in self.__neg """
@@ -792,7 +2322,7 @@ class Calcul:
     def selectableNegation(self) -> list:
         """ return tuples rid, set of positive lit """
         return [ (r.idnum, self.__selectableNeg(r.idnum))
-                 for r in self.__rules ]
+                 for r in self.__rules.values() ]
 
     #========================== some helpers =============================#
     def get_askableFacts(self) -> list:
@@ -819,22 +2349,26 @@ class Calcul:
     #======================= views on internal struct =====================#
     
     @property
-    def table(self):
-        """ a view of __symbTab """
-        return [ (x[0], repr(x[1])) for x in self.__symbTab.items() ]
+    def table(self) -> FaitVue:
+        """ a view of __symbTab: (userid, repr(Fait)) """
+        return FaitVue(self.__symbTab.items(),
+                       fmt=lambda x: (x[0], repr(x[1])),
+                       facts=self.__symbTab)
     @property
-    def rules(self):
+    def rules(self) -> Vue:
         """ a view of __rules """
-        return [ repr(x) for x in self.__rules ]
+        return Vue(self.__rules.values())
     @property
-    def base(self):
+    def base(self) -> FaitVue:
         """ a view of __base """
-        return [ repr(self.__symbTab[x]) for x in self.__base ]
+        return FaitVue(self.__base, lambda x: (x, self.__symbTab[x]),
+                       lambda x: repr(x[1]))
 
     @property
-    def goals(self):
+    def goals(self) -> FaitVue:
         """ a view of __query """
-        return [ repr(self.__symbTab[x]) for x in self.__query ]
+        return FaitVue(self.__query, lambda x: (x, self.__symbTab[x]),
+                       lambda x: repr(x[1]))
 
     #=================== littéraux ========================================#
     def get_positive_idnum(self) -> set:
@@ -855,50 +2389,44 @@ class Calcul:
     
     def get_positive_userid(self) -> set:
         """ non- not- pas- are negative """
-        return frozenset([x for x in self.__symbTab
-                          if not any([x.startswith(pref)
-                                      for pref in self.__neg])])
+        return frozenset(self.__positives)
     def get_negative_userid(self) -> set:
         """ non- not- pas- are negative """
-        return frozenset([x for x in self.__symbTab
-                          if any([x.startswith(pref)
-                                      for pref in self.__neg])])
+        return frozenset(self.__negatives)
 
     def is_negative(self, key:str) -> bool:
-        """ negative if exists and starts with the right prefix 
-            be cautious: costly
-        """
-        return key in self.get_negative_userid()
+        """ negative if exists and starts with the right prefix """
+        return key in self.__negatives
 
     def is_positive(self, key:str) -> bool:
-        """ positive if exists and does not start with the right prefix 
-            be cautious: costly
-        """
-        return key in self.get_positive_userid()
-    
-    def __find_opposed_userid(self) -> set:
-        """ non- not- pas- are negative helper pour build_opposition """
-        # if no opposition -> create non-x
-        _pos = [x for x in self.get_positive_userid()
-                if self.get_opposition(x) is None]
-        _neg = [x[4:] for x in [y for y in self.get_negative_userid()
-                                if self.get_opposition(y) is None]]
-
-        _uniquepos = frozenset(_pos).difference(_neg)
-        for key in _uniquepos: self.__find_fact('non-'+key)
-        _uniqueneg = frozenset(_neg).difference(_pos)
-        for key in _uniqueneg: self.__find_fact(key)
-        return frozenset([(x[4:], x) for x in self.get_negative_userid()])
+        """ positive if exists and does not start with the right prefix """
+        return key in self.__positives
+
+    def __complement(self, key:str) -> tuple:
+        """ helper pour build_opposition: (positive, negative) or None """
+        if key in self.__negation: return None
+        if key in self.__negatives: return key[4:], key
+        for pref in self.__neg:
+            _other = pref+key
+            if _other in self.__negatives and _other not in self.__negation:
+                return key, _other
+        return key, 'non-'+key
 
     def build_opposition(self) -> bool:
-        """ make opposition real """
+        """ make opposition real
+            only the symbols created since the last call are processed
+        """
         _ok = True
-        for x, y in self.__find_opposed_userid():
-            _ = self.add_opposition(x, y)
-            if _ != 1:
-                print("Trouble for add_opposition({}, {}) -> {}"
-                      "".format(x, y, _))
-                _ok = False
+        while self.__fresh != []:
+            _pending, self.__fresh = self.__fresh, []
+            for key in _pending:
+                _pair = self.__complement(key)
+                if _pair is None: continue
+                _ = self.add_opposition(*_pair)
+                if _ != 1:
+                    print("Trouble for add_opposition({}, {}) -> {}"
+                          "".format(_pair[0], _pair[1], _))
+                    _ok = False
         return _ok
 
     def get_opposed_lit(self, key:str) -> str:
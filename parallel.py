@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Parallel evaluation of a forward chaining layer"
+
+import multiprocessing as mp
+
+# worker side, set once by _init
+_VALUES = None # shared array of fact values, indexed by slot
+_PREMISES = None # rule position -> tuple of slots
+_THETA = .2
+
+def _init(values, premises:list, theta:float) -> None:
+    global _VALUES, _PREMISES, _THETA
+    _VALUES, _PREMISES, _THETA = values, premises, theta
+
+def _discret(v:float) -> int:
+    """ same as Fait.discret """
+    if v > _THETA: return 1
+    if v < -_THETA: return -1
+    return 0
+
+def _eval_chunk(positions:list) -> list:
+    """ evaluation of the left part of some rules """
+    return [min([_discret(_VALUES[s]) for s in _PREMISES[p]])
+            for p in positions]
+
+class ParallelLayer:
+    """ a process pool working on a shared copy of the fact values
+        - facts: list of Fait, the position is the slot in shared memory
+        - rules: list of Regle
+    """
+    def __init__(self, facts:list, rules:list, workers:int=None,
+                 chunk:int=256, theta:float=.2) -> None:
+        self.__facts = facts
+        _slot = {f.idnum: i for i, f in enumerate(facts)}
+        self.__pos = {r.idnum: i for i, r in enumerate(rules)}
+        _premises = [tuple([_slot[x] for x in r.gauche]) for r in rules]
+        self.__values = mp.RawArray('d', max(len(facts), 1))
+        self.__chunk = chunk
+        self.__pool = mp.Pool(workers, _init,
+                              (self.__values, _premises, theta))
+
+    def close(self) -> None:
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool = None
+
+    def __del__(self): self.close()
+
+    def evaluate(self, rules:list) -> dict:
+        """ rule idnum -> value of get_evalLeft, in rule order """
+        for i, f in enumerate(self.__facts): self.__values[i] = f.valeur
+        _positions = [self.__pos[r.idnum] for r in rules]
+        _chunks = [_positions[i:i+self.__chunk]
+                   for i in range(0, len(_positions), self.__chunk)]
+        _values = []
+        # map keeps the order of the chunks: merge is deterministic
+        for _part in self.__pool.map(_eval_chunk, _chunks):
+            _values.extend(_part)
+        return {r.idnum: v for r, v in zip(rules, _values)}
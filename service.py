@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Asynchronous inference service, json over http or stdin"
+
+# a query is a json object
+# {"id": any, "kb": name, "facts": {atom: belief}, "goals": [atom],
+#  "regime": 0|1|2, "memory": bool,
+#  "budget": {"deadline": s, "max_firings": n, ...}}
+# the answer is a sequence of json lines sharing the id, sent at once
+# when the micro-batch holding the query is solved (no partial answer)
+# {"id": .., "event": "fact", "atom": .., "value": .., "rules": [..]}
+# {"id": .., "event": "done", "success": .., "nbRules": .., ...}
+#   "conflict": null or {"facts": [atom], "rules": [idnum]}
+#
+# http: POST /query (one query), POST /kb {"name", "rules", "opposition"}
+#       GET /metrics, GET /kbs
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from kernel_jalon04 import Budget, Calcul
+
+#===================== worker side ==============================#
+_KBS = {} # (name, digest) -> (Calcul, snapshot), one per worker
+
+def digest(spec:dict) -> str:
+    """ content key of a kb spec, shared by every Service of a process """
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()
+                        ).hexdigest()
+
+def _build(spec:dict) -> tuple:
+    """ a loaded Calcul and its pristine working memory """
+    c = Calcul()
+    with redirect_stdout(io.StringIO()):
+        c.clear()
+        for line in spec['rules']: c.add_regle(line)
+        for a, b in spec.get('oppositions', ()): c.add_opposition(a, b)
+        if spec.get('opposition', False): c.build_opposition()
+        if spec.get('compile', False): c.compile()
+    return c, c.snapshot()
+
+def _solve(c:Calcul, spec:dict, query:dict) -> dict:
+    """ one query on c, c is back to its snapshot afterwards """
+    for k, v in query.get('facts', {}).items():
+        c.add_knowledge(k)
+        c.change_knowledge(k, float(v))
+    if spec.get('opposition', False): c.build_opposition()
+    for g in query.get('goals', ()): c.add_goal(g)
+    _budget = query.get('budget', None)
+    _budget = None if _budget is None else Budget(**_budget)
+    _out = io.StringIO()
+    _t = time.perf_counter()
+    with redirect_stdout(_out):
+        _nb, _success = c.resolution(int(query.get('regime', 0)),
+                                     bool(query.get('memory', True)),
+                                     _budget)
+    _elapsed = time.perf_counter() - _t
+    _facts = [{'atom': k, 'value': c.get_userFact(k).valeur,
+               'rules': [r for r, _ in c.why(k)]}
+              for k in c.proof.derived()]
+    _partial = c.get_partial()
+    _conflict = c.get_conflict()
+    if _conflict is not None:
+        _conflict = {'facts': sorted(_conflict[0]),
+                     'rules': sorted(_conflict[1])}
+    return {'success': bool(_success), 'nbRules': _nb,
+            'inconsistance': c.inconsistance,
+            'conflict': _conflict,
+            'partial': None if _partial is None else _partial[0],
+            'facts': _facts, 'elapsed': _elapsed,
+            'diagnostics': _out.getvalue().splitlines()}
+
+def run_batch(name:str, key:str, spec:dict, queries:list) -> list:
+    """ a micro-batch against one kb, errors are per query
+        a query bringing atoms unknown to the kb leaves them in c,
+        c is then rebuilt instead of restored
+    """
+    _key = name, key # key: digest(spec)
+    if _key not in _KBS:
+        for k in [k for k in _KBS if k[0] == name]: del _KBS[k]
+        _KBS[_key] = _build(spec)
+    c, _snap = _KBS[_key]
+    _nb = len(c.table)
+    _res = []
+    for q in queries:
+        try:
+            _res.append(_solve(c, spec, q))
+        except Exception as _e:
+            _res.append({'error': "{}: {}".format(_e.__class__.__name__,
+                                                  _e)})
+        finally:
+            if len(c.table) != _nb:
+                c, _snap = _KBS[_key] = _build(spec)
+            else: c.restore(_snap)
+    return _res
+
+#===================== service side ==============================#
+class ServiceMetrics:
+    """ latency and throughput, latencies over the last window queries """
+    def __init__(self, window:int=1024) -> None:
+        self.__window = window
+        self.clear()
+
+    def clear(self) -> None:
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched = 0
+        self.latencies = deque(maxlen=self.__window)
+        self.completed = deque(maxlen=self.__window) # monotonic times
+
+    def record(self, latency:float, error:bool=False) -> None:
+        self.requests += 1
+        self.errors += int(error)
+        self.latencies.append(latency)
+        self.completed.append(time.monotonic())
+
+    def batch(self, size:int) -> None:
+        self.batches += 1
+        self.batched += size
+
+    def snapshot(self) -> dict:
+        _lat = sorted(self.latencies)
+        def _pct(p):
+            if not _lat: return 0.
+            return _lat[min(len(_lat)-1, int(p * len(_lat)))]
+        _now = time.monotonic()
+        _span = (_now - self.completed[0]) if len(self.completed) > 1 else 0.
+        return {'uptime': _now - self.started,
+                'requests': self.requests, 'errors': self.errors,
+                'batches': self.batches,
+                'mean_batch': self.batched / max(self.batches, 1),
+                'latency': {'p50': _pct(.5), 'p95': _pct(.95),
+                            'p99': _pct(.99),
+                            'max': _lat[-1] if _lat else 0.},
+                'throughput': (len(self.completed) / _span
+                               if _span > 0 else 0.)}
+
+class Service:
+    """ preloaded rule bases, queries to the same kb are gathered
+        for at most window seconds (max_batch queries) and solved
+        together in a worker
+        workers=0: a thread runs the batches, no process is spawned
+    """
+    def __init__(self, workers:int=2, window:float=.005,
+                 max_batch:int=32) -> None:
+        self.workers = workers
+        self.window = window
+        self.max_batch = max_batch
+        self.metrics = ServiceMetrics()
+        self.__kbs = {} # name -> (version, spec, digest)
+        self.__queues = {} # name -> asyncio.Queue
+        self.__tasks = []
+        self.__pool = None
+
+    #------------------- rule bases ---------------------#
+    def add_kb(self, name:str, rules:list, opposition:bool=False,
+               oppositions:list=(), compile:bool=False) -> int:
+        """ (re)load a kb, :return: its version """
+        _spec = {'rules': [r for r in rules if r.strip()],
+                 'opposition': opposition,
+                 'oppositions': [list(x) for x in oppositions],
+                 'compile': compile}
+        _version = self.__kbs.get(name, (0,))[0] + 1
+        _build(_spec) # fail here rather than in the workers
+        self.__kbs[name] = _version, _spec, digest(_spec)
+        return _version
+
+    def load_kb(self, name:str, path:str) -> int:
+        """ json spec, or text: one rule per line with opposition """
+        with open(path) as f:
+            if path.endswith('.json'):
+                return self.add_kb(name, **json.load(f))
+            return self.add_kb(name, f.read().split('\n'), True)
+
+    def kbs(self) -> dict:
+        return {k: {'version': v, 'rules': len(s['rules'])}
+                for k, (v, s, _) in self.__kbs.items()}
+
+    #------------------- life cycle ---------------------#
+    async def start(self) -> None:
+        if self.__pool is not None: return
+        self.__pool = (ThreadPoolExecutor(1) if self.workers == 0
+                       else ProcessPoolExecutor(self.workers))
+
+    async def close(self) -> None:
+        for t in self.__tasks: t.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.__tasks, self.__queues = [], {}
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
+    async def __aenter__(self) -> 'Service':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    #------------------- queries ---------------------#
+    async def query(self, query:dict) -> dict:
+        """ the full answer of one query """
+        _t = time.perf_counter()
+        _name = query.get('kb', None)
+        if _name not in self.__kbs:
+            self.metrics.record(time.perf_counter() - _t, True)
+            return {'error': "unknown kb {!r}".format(_name)}
+        await self.start()
+        if _name not in self.__queues:
+            self.__queues[_name] = asyncio.Queue()
+            self.__tasks.append(asyncio.ensure_future(
+                self.__batcher(_name, self.__queues[_name])))
+        _fut = asyncio.get_event_loop().create_future()
+        await self.__queues[_name].put((query, _fut))
+        _res = await _fut
+        self.metrics.record(time.perf_counter() - _t, 'error' in _res)
+        return _res
+
+    async def stream(self, query:dict):
+        """ json-ready events: one per derived fact then done
+            the answer is delivered whole: the events are yielded once
+            the micro-batch holding the query is solved, the worker
+            does not send facts while it derives them
+        """
+        _res = await self.query(query)
+        _id = query.get('id', None)
+        if 'error' in _res:
+            yield {'id': _id, 'event': 'error', 'error': _res['error']}
+            return
+        for f in _res.pop('facts'):
+            yield dict(f, id=_id, event='fact')
+        yield dict(_res, id=_id, event='done')
+
+    async def __batcher(self, name:str, queue:asyncio.Queue) -> None:
+        """ gather then hand over to the pool """
+        _loop = asyncio.get_event_loop()
+        while True:
+            _batch = [await queue.get()]
+            _end = _loop.time() + self.window
+            while len(_batch) < self.max_batch:
+                _left = _end - _loop.time()
+                if _left <= 0: break
+                try:
+                    _batch.append(await asyncio.wait_for(queue.get(), _left))
+                except asyncio.TimeoutError:
+                    break
+            self.metrics.batch(len(_batch))
+            _, _spec, _key = self.__kbs[name]
+            try:
+                _res = await _loop.run_in_executor(
+                    self.__pool, run_batch, name, _key, _spec,
+                    [q for q, _ in _batch])
+            except Exception as _e:
+                _res = [{'error': "{}: {}".format(_e.__class__.__name__,
+                                                  _e)}] * len(_batch)
+            for (_, fut), r in zip(_batch, _res):
+                if not fut.done(): fut.set_result(r)
+
+#===================== protocols ==============================#
+_STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed"}
+
+async def _http_client(service:Service, reader, writer) -> None:
+    """ a minimal HTTP/1.1, one request per connection """
+    try:
+        _line = (await reader.readline()).decode('latin-1').split()
+        _headers = {}
+        while True:
+            _h = await reader.readline()
+            if _h in (b'\r\n', b'\n', b''): break
+            k, _, v = _h.decode('latin-1').partition(':')
+            _headers[k.strip().lower()] = v.strip()
+        _body = await reader.readexactly(int(_headers.get('content-length',
+                                                          0)))
+        if len(_line) < 2:
+            return await _http_reply(writer, 400, {'error': "bad request"})
+        _meth, _path = _line[0], _line[1]
+        if _path == '/metrics' and _meth == 'GET':
+            return await _http_reply(writer, 200, service.metrics.snapshot())
+        if _path == '/kbs' and _meth == 'GET':
+            return await _http_reply(writer, 200, service.kbs())
+        if _path not in ('/query', '/kb'):
+            return await _http_reply(writer, 404, {'error': _path})
+        if _meth != 'POST':
+            return await _http_reply(writer, 405, {'error': _meth})
+        try:
+            _data = json.loads(_body or b'{}')
+            if _path == '/kb':
+                _name = _data.pop('name')
+                return await _http_reply(
+                    writer, 200,
+                    {'name': _name, 'version': service.add_kb(_name,
+                                                              **_data)})
+        except Exception as _e:
+            return await _http_reply(writer, 400, {'error': str(_e)})
+        # json lines in chunks, written once the answer is complete
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\n"
+                     b"Connection: close\r\n\r\n")
+        async for _ev in service.stream(_data):
+            _chunk = (json.dumps(_ev) + '\n').encode()
+            writer.write(b"%x\r\n%s\r\n" % (len(_chunk), _chunk))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def _http_reply(writer, status:int, data:dict) -> None:
+    _body = json.dumps(data).encode()
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+                 "Content-Length: {}\r\nConnection: close\r\n\r\n"
+                 "".format(status, _STATUS[status], len(_body)).encode()
+                 + _body)
+    await writer.drain()
+
+async def serve_http(service:Service, host:str='127.0.0.1',
+                     port:int=8765):
+    """ :return: the asyncio server, already listening """
+    return await asyncio.start_server(
+        lambda r, w: _http_client(service, r, w), host, port)
+
+async def serve_stdin(service:Service, rfile=None, wfile=None) -> None:
+    """ one query per input line, events written as json lines
+        queries are concurrent, their events may interleave
+    """
+    rfile = sys.stdin if rfile is None else rfile
+    wfile = sys.stdout if wfile is None else wfile
+    _loop = asyncio.get_event_loop()
+    _pending = set()
+
+    async def _one(line):
+        try:
+            _q = json.loads(line)
+        except ValueError as _e:
+            wfile.write(json.dumps({'event': 'error', 'error': str(_e)})
+                        + '\n')
+            return
+        if _q.get('metrics', False):
+            wfile.write(json.dumps(dict(service.metrics.snapshot(),
+                                        event='metrics')) + '\n')
+            return
+        async for _ev in service.stream(_q):
+            wfile.write(json.dumps(_ev) + '\n')
+        wfile.flush()
+
+    while True:
+        _line = await _loop.run_in_executor(None, rfile.readline)
+        if _line == '': break
+        if _line.strip() == '': continue
+        _t = asyncio.ensure_future(_one(_line))
+        _pending.add(_t)
+        _t.add_done_callback(_pending.discard)
+    if _pending: await asyncio.gather(*_pending)
+    wfile.flush()
+
+async def _main(args) -> int:
+    async with Service(args.workers, args.window, args.batch) as _s:
+        for item in args.kb:
+            _name, _, _path = item.partition('=')
+            _s.load_kb(_name, _path)
+        if args.http is None:
+            await serve_stdin(_s)
+            return 0
+        _srv = await serve_http(_s, args.host, args.http)
+        print("serving on http://{}:{}".format(args.host, args.http),
+              file=sys.stderr)
+        async with _srv:
+            await _srv.serve_forever()
+    return 0
+
+def main(argv:list=None) -> int:
+    _p = argparse.ArgumentParser(description=__usage__)
+    _p.add_argument('--kb', action='append', default=[],
+                    metavar='NAME=PATH', help="rule base to preload")
+    _p.add_argument('--http', type=int, metavar='PORT',
+                    help="serve http, default is stdin/stdout")
+    _p.add_argument('--host', default='127.0.0.1')
+    _p.add_argument('--workers', type=int, default=2,
+                    help="processes, 0 for a single thread")
+    _p.add_argument('--window', type=float, default=.005,
+                    help="seconds spent gathering a batch")
+    _p.add_argument('--batch', type=int, default=32,
+                    help="largest batch")
+    try:
+        return asyncio.run(_main(_p.parse_args(argv)))
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
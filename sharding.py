@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Forward saturation over rule shards in worker processes"
+
+import io
+import multiprocessing as mp
+from collections import deque
+from contextlib import redirect_stdout
+
+from kernel_jalon04 import Calcul
+
+#===================== partition ==============================#
+def rule_line(c:Calcul, rule) -> str:
+    """ text accepted by add_regle """
+    _txt = c.rule_text(rule)
+    return _txt if rule.fiabilite == 1 else "{} {}".format(_txt,
+                                                          rule.fiabilite)
+
+def partition(c:Calcul, shards:int) -> list:
+    """ rules of c split by conclusion, a literal and its opposite
+        stay together
+        greedy: conclusions in breadth first order of the dependency
+        graph, cut into chunks of balanced size, then one pass moving
+        each conclusion towards the shard of most of its neighbours
+        :return: list of shards, each a list of rule idnums
+    """
+    _group = {} # conclusion -> its group key
+    _rules = {} # group -> rule idnums
+    for r in c.rules.raw_items():
+        _c = c.get_useridList(r.droite)[0]
+        _o = c.get_opposition(_c)
+        _g = _c if _o is None else min(_c, _o)
+        _group[_c] = _g
+        _rules.setdefault(_g, []).append(r.idnum)
+    # neighbours: a premise concluded by another group
+    _adj = {g: set() for g in _rules}
+    for g, rids in _rules.items():
+        for rid in rids:
+            for x in c.get_useridList(c.get_regle(rid).gauche):
+                for y in (x, c.get_opposition(x)):
+                    h = _group.get(y, None)
+                    if h is not None and h != g:
+                        _adj[g].add(h)
+                        _adj[h].add(g)
+    _order, _seen = [], set()
+    for g in sorted(_rules):
+        if g in _seen: continue
+        _seen.add(g)
+        _todo = deque([g])
+        while _todo:
+            h = _todo.popleft()
+            _order.append(h)
+            for k in sorted(_adj[h] - _seen):
+                _seen.add(k)
+                _todo.append(k)
+    _total = sum([len(x) for x in _rules.values()])
+    _cap = _total / max(shards, 1)
+    _where, _size, _s = {}, [0] * shards, 0
+    for g in _order:
+        if _size[_s] >= _cap and _s < shards - 1: _s += 1
+        _where[g] = _s
+        _size[_s] += len(_rules[g])
+    # refinement, within 10% of the balanced size
+    for g in _order:
+        _votes = [0] * shards
+        for h in _adj[g]: _votes[_where[h]] += 1
+        _best = max(range(shards), key=lambda s: (_votes[s],
+                                                   s == _where[g]))
+        if (_best != _where[g] and
+            _size[_best] + len(_rules[g]) <= 1.1 * _cap):
+            _size[_where[g]] -= len(_rules[g])
+            _size[_best] += len(_rules[g])
+            _where[g] = _best
+    _out = [[] for _ in range(shards)]
+    for g, rids in _rules.items(): _out[_where[g]].extend(rids)
+    return [sorted(x) for x in _out]
+
+def cut_edges(c:Calcul, shards:list) -> int:
+    """ premises whose conclusion is computed in another shard """
+    _home = {}
+    for s, rids in enumerate(shards):
+        for rid in rids:
+            _home[c.get_useridList(c.get_regle(rid).droite)[0]] = s
+    _cut = 0
+    for s, rids in enumerate(shards):
+        for rid in rids:
+            for x in c.get_useridList(c.get_regle(rid).gauche):
+                if _home.get(x, s) != s: _cut += 1
+    return _cut
+
+#===================== worker side ==============================#
+def _worker(conn, rules:list, oppositions:list, facts:dict) -> None:
+    """ one shard: saturate, report the changed facts, wait for more """
+    c = Calcul()
+    with redirect_stdout(io.StringIO()):
+        c.clear()
+        for line in rules: c.add_regle(line)
+        for a, b in oppositions: c.add_opposition(a, b)
+        c.set_facts(list(facts), list(facts.values()))
+    while True:
+        _msg = conn.recv()
+        if _msg[0] == 'stop': break
+        _in = _msg[1]
+        if _in: c.set_facts(list(_in), list(_in.values()))
+        _before = {k: f.valeur for k, f in c.table.raw_items()}
+        with redirect_stdout(io.StringIO()):
+            _nb, _ = c.resolution(1, True)
+        _out = {k: f.valeur for k, f in c.table.raw_items()
+                if _before.get(k, 0) != f.valeur}
+        conn.send((_nb, c.inconsistance, _out))
+    conn.close()
+
+#===================== coordinator ==============================#
+class Sharded:
+    """ bulk synchronous rounds: every shard saturates, the boundary
+        facts are exchanged through pipes, until nothing moves
+        the merged facts are written back into calcul
+    """
+    def __init__(self, calcul:Calcul, shards:int=2) -> None:
+        self.calcul = calcul
+        self.shards = [x for x in partition(calcul, shards) if x]
+        self.rounds = 0
+        self.inconsistance = False
+        _opp = []
+        for k in calcul.table.keys():
+            _o = calcul.get_opposition(k)
+            if _o is not None and k < _o: _opp.append((k, _o))
+        self.__opp = _opp
+        # facts each shard reads: its premises and their opposites
+        self.__imports = []
+        for rids in self.shards:
+            _imp = set()
+            for rid in rids:
+                for x in calcul.get_useridList(
+                        calcul.get_regle(rid).gauche):
+                    _imp.add(x)
+                    _o = calcul.get_opposition(x)
+                    if _o is not None: _imp.add(_o)
+            self.__imports.append(_imp)
+
+    def cut_edges(self) -> int:
+        return cut_edges(self.calcul, self.shards)
+
+    def run(self) -> tuple:
+        """ saturation, :return: (nbRules, success) as resolution """
+        c = self.calcul
+        _keys = list(c.base.keys())
+        _facts = dict(zip(_keys, c.get_facts(_keys, numpy=False)))
+        _goals = c.get_goals()
+        _ctx = mp.get_context()
+        _conns, _procs = [], []
+        for rids in self.shards:
+            _a, _b = _ctx.Pipe()
+            _p = _ctx.Process(target=_worker, daemon=True,
+                              args=(_b, [rule_line(c, c.get_regle(r))
+                                         for r in rids],
+                                    self.__opp, _facts))
+            _p.start()
+            _conns.append(_a)
+            _procs.append(_p)
+        _nb = 0
+        _derived = {}
+        _inbox = [{} for _ in self.shards]
+        self.rounds = 0
+        self.inconsistance = False
+        try:
+            while True:
+                self.rounds += 1
+                for conn, _in in zip(_conns, _inbox): conn.send(('run', _in))
+                _inbox = [{} for _ in self.shards]
+                for s, conn in enumerate(_conns):
+                    _n, _inc, _out = conn.recv()
+                    _nb += _n
+                    self.inconsistance |= _inc
+                    for k, v in _out.items():
+                        if _derived.get(k, _facts.get(k, None)) == v:
+                            continue
+                        _derived[k] = v
+                        for t, _imp in enumerate(self.__imports):
+                            if t != s and k in _imp: _inbox[t][k] = v
+                # quiescence: no shard has anything new to read
+                if not any(_inbox) or self.inconsistance: break
+        finally:
+            for conn in _conns:
+                conn.send(('stop',))
+                conn.close()
+            for _p in _procs: _p.join()
+        _new = [k for k in _derived if k not in _facts]
+        if _derived:
+            c.set_facts(list(_derived), list(_derived.values()))
+        c.inconsistance = self.inconsistance
+        if self.inconsistance: return _nb, False
+        if _goals:
+            return _nb, all([c.get_userFact(g).discret() == 1
+                             for g in _goals])
+        return _nb, _new != []
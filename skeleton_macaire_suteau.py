@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import heapq
 from copy import copy
 from numbers import Number
 from kernel_jalon04 import Calcul
@@ -126,6 +127,108 @@ class NegAsFailure(Calcul):
 class Mycin(Calcul):
     """ computation à la Mycin """
 
+    THETA = .2  # a rule contributes when its premises are above THETA
+    MAX_UPDATES = 100  # per atom and per propagation, for cyclic rules
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__contrib = None  # conclusion -> {rule idnum: cf}, incremental
+        self.__rank = None  # (version, rule idnum -> stratum)
+
+    def clear(self):
+        super().clear()
+        self.__contrib = None
+
+    def change_knowledge(self, keysymb: str, val: float) -> bool:
+        """ surcharge: in incremental mode the downstream cone follows """
+        _ = super().change_knowledge(keysymb, val)
+        if self.__contrib is not None:
+            _not = self.get_opposition(keysymb)
+            self.__propagate([keysymb] if _not is None else [keysymb, _not])
+        return _
+
+    def _after_set(self, names: list) -> None:
+        """ surcharge: set_facts re-folds the downstream cone once """
+        if self.__contrib is not None: self.__propagate(names)
+
+    #================= incremental mode ======================#
+    def start_incremental(self) -> None:
+        """ compute every contribution once, then change_knowledge
+            only re-folds the rules downstream of the changed fact
+        """
+        self.__contrib = {}
+        self.__propagate([k for k, _ in self.table])
+
+    def stop_incremental(self) -> None:
+        self.__contrib = None
+
+    @property
+    def incremental(self) -> bool:
+        return self.__contrib is not None
+
+    def contributions(self, keysymb: str) -> dict:
+        """ rule idnum -> cf brought to keysymb """
+        if self.__contrib is None: return {}
+        return dict(self.__contrib.get(keysymb, {}))
+
+    def __ranks(self) -> dict:
+        """ rule idnum -> index of its stratum, see Calcul.strata """
+        if self.__rank is None or self.__rank[0] != self.version:
+            _rank = {}
+            for k, (rids, _) in enumerate(self.strata()):
+                for rid in rids: _rank[rid] = k
+            self.__rank = self.version, _rank
+        return self.__rank[1]
+
+    def __contribution(self, r) -> float:
+        _v = self.get_evalLeft(r.gauche)
+        return round(_v * r.fiabilite, 3) if _v > self.THETA else None
+
+    def __fold(self, keysymb: str) -> float:
+        _val = 0.
+        for _, cf in sorted(self.__contrib.get(keysymb, {}).items()):
+            _val = cf if _val == 0 else self.agregate(_val, cf)
+        return _val
+
+    def __store(self, keysymb: str, val: float) -> None:
+        """ belief of a derived fact, base follows check_discret """
+        _f = self.get_userFact(keysymb)
+        _f.valeur = val
+        _not = self.get_opposition(keysymb)
+        if _not is not None: self.get_userFact(_not).valeur = -val
+        if _f.discret() == 0:
+            if self.check_knowledge(keysymb): self.del_knowledge(keysymb)
+        elif not self.check_knowledge(keysymb):
+            super().add_knowledge(keysymb)
+
+    def __propagate(self, changed: list) -> None:
+        """ worklist in stratum order: the rules using a changed fact
+            or its opposite are re-evaluated, their conclusions re-folded
+        """
+        _rank = self.__ranks()
+        _heap = [(-1, k) for k in changed]
+        heapq.heapify(_heap)
+        _updates = {}
+        while _heap:
+            _, k = heapq.heappop(_heap)
+            for rid in set(self.get_userFact(k).gauche):
+                r = self.get_regle(rid)
+                _c = self.get_useridList(r.droite)[0]
+                _cf = self.__contribution(r)
+                _old = self.__contrib.setdefault(_c, {})
+                if _old.get(rid, None) == _cf: continue
+                if _cf is None: del _old[rid]
+                else: _old[rid] = _cf
+                _val = self.__fold(_c)
+                if _val == self.get_userFact(_c).valeur: continue
+                _updates[_c] = _updates.get(_c, 0) + 1
+                if _updates[_c] > self.MAX_UPDATES: continue
+                self.__store(_c, _val)
+                heapq.heappush(_heap, (_rank[rid], _c))
+                _not = self.get_opposition(_c)  # rewritten by __store
+                if _not is not None:
+                    heapq.heappush(_heap, (_rank[rid], _not))
+
     def resolution(self, idx: int, withMem: bool) -> (int, bool):
         """ surcharge de resolution permet de bloquer
             pour l'utilisateur Calcul.resolution
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Rule statistics learned across resolutions"
+
+import json
+import os
+from collections import deque
+
+class RuleStats:
+    """ per rule: successes, failures and proof cost (rules tried)
+        a rule is known by its text "a & b -> c" so that the stats
+        survive a reload of the knowledge base
+        runs: (regime, nbRules) of the last resolutions
+    """
+    def __init__(self, path:str=None, prior:float=1.,
+                 maxruns:int=1000) -> None:
+        """ path: json file, loaded if it exists
+            prior: Laplace smoothing of the success rate
+        """
+        self.path = path
+        self.prior = prior
+        self.__rules = {} # key -> [success, failure, cost]
+        self.runs = deque(maxlen=maxruns)
+        if path is not None and os.path.exists(path): self.load(path)
+
+    def __len__(self) -> int: return len(self.__rules)
+    def __contains__(self, key:str) -> bool: return key in self.__rules
+
+    def clear(self) -> None:
+        self.__rules.clear()
+        self.runs.clear()
+
+    def get(self, key:str) -> tuple:
+        """ (success, failure, cost) """
+        return tuple(self.__rules.get(key, (0, 0, 0)))
+
+    def record(self, key:str, success:bool, cost:int=1) -> None:
+        _s = self.__rules.setdefault(key, [0, 0, 0])
+        _s[0 if success else 1] += 1
+        _s[2] += cost
+
+    def run(self, regime:int, nbRules:int) -> None:
+        self.runs.append((regime, nbRules))
+
+    def score(self, key:str) -> float:
+        """ expected success per unit of cost, unknown rules get the prior """
+        _s, _f, _c = self.get(key)
+        _n = _s + _f
+        _p = (_s + self.prior) / (_n + 2 * self.prior)
+        return _p / (_c / _n if _n else 1.)
+
+    def order(self, rules:list, key) -> list:
+        """ best score first, ties keep their order
+            key: rule -> its text
+        """
+        return sorted(rules, key=lambda r: -self.score(key(r)))
+
+    def mean_nbRules(self, regime:int=None) -> float:
+        """ average nbRules over the recorded runs """
+        _nb = [n for reg, n in self.runs if regime is None or reg == regime]
+        return sum(_nb) / len(_nb) if _nb else 0.
+
+    def to_dict(self) -> dict:
+        return {'prior': self.prior,
+                'rules': {k: list(v) for k, v in self.__rules.items()},
+                'runs': [list(x) for x in self.runs]}
+
+    def save(self, path:str=None) -> None:
+        """ atomic write of the json file """
+        _path = self.path if path is None else path
+        if _path is None: raise ValueError("no path to save the stats")
+        with open(_path + '.tmp', 'w') as f: json.dump(self.to_dict(), f)
+        os.replace(_path + '.tmp', _path)
+
+    def load(self, path:str=None) -> None:
+        """ merge the counts stored in path """
+        _path = self.path if path is None else path
+        with open(_path) as f: _data = json.load(f)
+        for k, v in _data.get('rules', {}).items():
+            _s = self.__rules.setdefault(k, [0, 0, 0])
+            for i in range(3): _s[i] += v[i]
+        for x in _data.get('runs', ()): self.runs.append(tuple(x))
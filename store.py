@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+__date__ = "19.10.26"
+__usage__ = "Persistent knowledge base on SQLite"
+
+import sqlite3
+
+from kernel_jalon04 import Calcul, parseRule
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS symbols (
+    id INTEGER PRIMARY KEY,
+    userid TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS rules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conclusion INTEGER NOT NULL,
+    fiab REAL NOT NULL,
+    text TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS premises (
+    rule INTEGER NOT NULL,
+    atom INTEGER NOT NULL,
+    PRIMARY KEY (rule, atom));
+CREATE INDEX IF NOT EXISTS premises_atom ON premises(atom);
+CREATE INDEX IF NOT EXISTS rules_conclusion ON rules(conclusion);
+CREATE TABLE IF NOT EXISTS oppositions (
+    a TEXT PRIMARY KEY,
+    b TEXT NOT NULL);
+"""
+_CHUNK = 500 # below the sqlite limit of host parameters
+_NEG = ('not-', 'non-', 'pas-') # negative prefixes, as in Calcul
+
+def _chunks(seq:list):
+    seq = list(seq)
+    for i in range(0, len(seq), _CHUNK): yield seq[i:i+_CHUNK]
+
+class SQLiteStore:
+    """ rules, symbols and oppositions with indexes on premises
+        and conclusions
+    """
+    def __init__(self, path:str=':memory:') -> None:
+        self.__db = sqlite3.connect(path)
+        self.__db.executescript(_SCHEMA)
+        self.__db.commit()
+
+    def close(self) -> None:
+        self.__db.close()
+
+    def __len__(self) -> int:
+        return self.__db.execute("SELECT COUNT(*) FROM rules").fetchone()[0]
+
+    def symbol(self, userid:str) -> int:
+        """ id of userid, created if needed """
+        self.__db.execute("INSERT OR IGNORE INTO symbols(userid) VALUES (?)",
+                          (userid,))
+        return self.__db.execute("SELECT id FROM symbols WHERE userid = ?",
+                                 (userid,)).fetchone()[0]
+
+    def __insert(self, regle:str) -> int:
+        _g, _d, fiab = parseRule(regle)
+        _cur = self.__db.execute(
+            "INSERT INTO rules(conclusion, fiab, text) VALUES (?, ?, ?)",
+            (self.symbol(_d[0]), fiab, regle.strip()))
+        _rid = _cur.lastrowid
+        self.__db.executemany(
+            "INSERT OR IGNORE INTO premises(rule, atom) VALUES (?, ?)",
+            [(_rid, self.symbol(x)) for x in _g])
+        return _rid
+
+    def add_rule(self, regle:str) -> int:
+        """ store a rule, :return: its id """
+        _rid = self.__insert(regle)
+        self.__db.commit()
+        return _rid
+
+    def add_rules(self, rules:list) -> list:
+        """ bulk load in a single transaction """
+        _rids = [self.__insert(r) for r in rules]
+        self.__db.commit()
+        return _rids
+
+    def remove_rule(self, rid:int) -> bool:
+        _cur = self.__db.execute("DELETE FROM rules WHERE id = ?", (rid,))
+        self.__db.execute("DELETE FROM premises WHERE rule = ?", (rid,))
+        self.__db.commit()
+        return _cur.rowcount > 0
+
+    def rules(self) -> list:
+        """ every (id, text) in rule order """
+        return self.__db.execute(
+            "SELECT id, text FROM rules ORDER BY id").fetchall()
+
+    def __fetch(self, query:str, atoms:list) -> list:
+        _rids = set()
+        for part in _chunks(atoms):
+            _q = query.format(','.join('?'*len(part)))
+            _rids.update([x[0] for x in self.__db.execute(_q, part)])
+        return self.__details(sorted(_rids))
+
+    def __details(self, rids:list) -> list:
+        """ (id, text, premises) for some rule ids """
+        _prem = {}
+        _text = {}
+        for part in _chunks(rids):
+            _in = ','.join('?'*len(part))
+            for rid, text in self.__db.execute(
+                    "SELECT id, text FROM rules WHERE id IN ({})"
+                    "".format(_in), part):
+                _text[rid] = text
+            for rid, userid in self.__db.execute(
+                    "SELECT p.rule, s.userid FROM premises p"
+                    " JOIN symbols s ON s.id = p.atom"
+                    " WHERE p.rule IN ({})".format(_in), part):
+                _prem.setdefault(rid, []).append(userid)
+        return [(rid, _text[rid], _prem.get(rid, [])) for rid in rids]
+
+    def rules_using(self, atoms:list) -> list:
+        """ rules with a premise in atoms: list of (id, text, premises) """
+        return self.__fetch("SELECT p.rule FROM premises p"
+                            " JOIN symbols s ON s.id = p.atom"
+                            " WHERE s.userid IN ({})", atoms)
+
+    def rules_concluding(self, atoms:list) -> list:
+        """ rules whose conclusion is in atoms """
+        return self.__fetch("SELECT r.id FROM rules r"
+                            " JOIN symbols s ON s.id = r.conclusion"
+                            " WHERE s.userid IN ({})", atoms)
+
+    def add_opposition(self, key1:str, key2:str) -> None:
+        self.__db.executemany(
+            "INSERT OR REPLACE INTO oppositions(a, b) VALUES (?, ?)",
+            [(key1, key2), (key2, key1)])
+        self.__db.commit()
+
+    def oppositions(self) -> list:
+        """ each pair once """
+        return self.__db.execute(
+            "SELECT a, b FROM oppositions WHERE a < b").fetchall()
+
+    def opposites(self, atoms:list) -> dict:
+        """ atom -> its stored opposite, for the atoms having one """
+        _out = {}
+        for part in _chunks(atoms):
+            _out.update(self.__db.execute(
+                "SELECT a, b FROM oppositions WHERE a IN ({})"
+                "".format(','.join('?'*len(part))), part))
+        return _out
+
+    def __pair(self, prefix:str) -> None:
+        """ unbound positive p with the unbound symbol prefix+p """
+        _free = ("NOT EXISTS (SELECT 1 FROM oppositions o"
+                 " WHERE o.a = {}.userid)")
+        self.__db.execute("DROP TABLE IF EXISTS temp._pairs")
+        self.__db.execute(
+            "CREATE TEMP TABLE _pairs AS SELECT p.userid AS a, n.userid AS b"
+            " FROM symbols p JOIN symbols n ON n.userid = ? || p.userid"
+            " WHERE substr(p.userid, 1, 4) NOT IN ({}) AND {} AND {}"
+            "".format(','.join('?'*len(_NEG)), _free.format('p'),
+                      _free.format('n')), (prefix,) + _NEG)
+        self.__db.execute("INSERT INTO oppositions(a, b)"
+                          " SELECT a, b FROM _pairs"
+                          " UNION ALL SELECT b, a FROM _pairs")
+        self.__db.execute("DROP TABLE temp._pairs")
+
+    def build_oppositions(self) -> int:
+        """ Calcul.build_opposition over the whole symbol table, in sql
+            - a negative prefix-x gets its positive x
+            - x is paired with not-x, non-x or pas-x, in that order
+            - an x left alone gets a new non-x
+            :return: number of pairs stored
+        """
+        _n = len(self.oppositions())
+        _in = ','.join('?'*len(_NEG))
+        self.__db.execute(
+            "INSERT OR IGNORE INTO symbols(userid)"
+            " SELECT substr(userid, 5) FROM symbols"
+            " WHERE substr(userid, 1, 4) IN ({})".format(_in), _NEG)
+        for pref in _NEG: self.__pair(pref)
+        self.__db.execute(
+            "INSERT OR IGNORE INTO symbols(userid)"
+            " SELECT 'non-' || s.userid FROM symbols s"
+            " WHERE substr(s.userid, 1, 4) NOT IN ({}) AND NOT EXISTS"
+            " (SELECT 1 FROM oppositions o WHERE o.a = s.userid)"
+            "".format(_in), _NEG)
+        self.__pair('non-')
+        self.__db.commit()
+        return len(self.oppositions()) - _n
+
+class PersistentCalcul(Calcul):
+    """ Calcul whose rules live in a SQLiteStore
+        rules are paged into memory when resolution may touch them,
+        a symbol gets its stored opposite when it enters memory
+    """
+    def __init__(self, path:str=':memory:') -> None:
+        super().__init__()
+        self.__store = SQLiteStore(path)
+        self.__paged = set()
+
+    @property
+    def store(self) -> SQLiteStore:
+        return self.__store
+
+    def clear(self):
+        """ reset memory, the store is untouched """
+        super().clear()
+        self.__paged.clear()
+
+    def add_regle(self, regle:str) -> int:
+        """ stored at once, paged in by the next resolution """
+        return self.__store.add_rule(regle)
+
+    def add_regles(self, rules:list) -> list:
+        """ bulk version of add_regle """
+        return self.__store.add_rules(rules)
+
+    def remove_regle(self, idnum:int) -> bool:
+        _ok = self.__store.remove_rule(idnum)
+        if idnum in self.__paged:
+            self.__paged.discard(idnum)
+            super().remove_regle(idnum)
+        return _ok
+
+    def add_opposition(self, key1:str, key2:str) -> int:
+        _ = super().add_opposition(key1, key2)
+        if self.get_opposition(key1) == key2:
+            self.__store.add_opposition(key1, key2)
+        return _
+
+    def build_opposition(self) -> bool:
+        """ the pairs are computed in the store, over every symbol,
+            then the symbols in memory get theirs
+        """
+        self.__store.build_oppositions()
+        self.__bind([k for k, _ in self.table.items()])
+        return super().build_opposition()
+
+    def __bind(self, atoms) -> None:
+        """ the stored opposites of atoms, brought into memory """
+        _todo = [x for x in atoms if self.get_opposition(x) is None]
+        for a, b in self.__store.opposites(_todo).items():
+            if self.get_opposition(a) is None:
+                Calcul.add_opposition(self, a, b)
+
+    def add_knowledge(self, keysymb:str) -> None:
+        self.__bind([keysymb])
+        return super().add_knowledge(keysymb)
+
+    def set_facts(self, names, values) -> None:
+        names = list(names)
+        self.__bind(names)
+        return super().set_facts(names, values)
+
+    def __load(self, rid:int, text:str) -> None:
+        if rid in self.__paged: return
+        Calcul.add_regle(self, text, rid)
+        self.__paged.add(rid)
+        _g, _d, _ = parseRule(text)
+        self.__bind(_g + _d)
+
+    def __closure(self, atoms:set) -> set:
+        """ atoms and their opposites """
+        self.__bind(atoms)
+        _ = set(atoms)
+        for x in atoms:
+            _not = self.get_opposition(x)
+            if _not is not None: _.add(_not)
+        return _
+
+    def page_forward(self) -> int:
+        """ rules whose premises can all be reached from the base
+            :return: number of rules paged in
+        """
+        _n = len(self.__paged)
+        _reached = self.__closure(set([k for k, _ in self.base.items()]))
+        _frontier = list(_reached)
+        while _frontier != []:
+            _new = set()
+            for rid, text, prem in self.__store.rules_using(_frontier):
+                if rid in self.__paged: continue
+                if not _reached.issuperset(prem): continue
+                self.__load(rid, text)
+                _new.update(parseRule(text)[1])
+            _new = self.__closure(_new).difference(_reached)
+            _reached.update(_new)
+            _frontier = list(_new)
+        return len(self.__paged) - _n
+
+    def add_goal(self, keysymb:str) -> bool:
+        """ the rules able to prove keysymb are paged in first """
+        self.page_backward([keysymb])
+        return super().add_goal(keysymb)
+
+    def page_backward(self, atoms:list=None) -> int:
+        """ every rule in the backward cone of atoms (default: goals) """
+        _n = len(self.__paged)
+        if atoms is None: atoms = [k for k, _ in self.goals.items()]
+        _seen = self.__closure(set(atoms))
+        _frontier = list(_seen)
+        while _frontier != []:
+            _new = set()
+            for rid, text, prem in self.__store.rules_concluding(_frontier):
+                if rid in self.__paged: continue
+                self.__load(rid, text)
+                _new.update(prem)
+            _new = self.__closure(_new).difference(_seen)
+            _seen.update(_new)
+            _frontier = list(_new)
+        return len(self.__paged) - _n
+
+    def page_all(self) -> int:
+        """ load the whole store, needed before selectable* helpers """
+        _n = len(self.__paged)
+        for rid, text in self.__store.rules(): self.__load(rid, text)
+        return len(self.__paged) - _n
+
+    def resolution(self, reg_mod:int, memory:bool, budget=None) -> tuple:
+        """ page in what the regime may use, then resolution """
+        if reg_mod in (0, 1): self.page_forward()
+        elif reg_mod == 2: self.page_backward()
+        return super().resolution(reg_mod, memory, budget)
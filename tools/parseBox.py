@@ -63,8 +63,7 @@ def trace(c:'Calcul', vocabulaire:dict):
     """
     print("{0} {1} {0}".format("="*7,
                                "Trace for {}".format(c.__class__.__name__)))
-    for atom in vocabulaire:
-        _f = c.get_userFact(atom)
-        if _f.valeur != 0:
+    for atom, _f in c.table.nonzero().items():
+        if atom in vocabulaire:
             print("{}: {}".format(atom, _f.valeur))
     print("{}".format("="*(16+5)))